@@ -1,22 +1,40 @@
 import os
 import uuid
+import time
 import asyncio
+import collections
 import json
 import mimetypes
 import html
 import re
 import math
+import base64
+import hashlib
+import sqlite3
+import threading
+import fcntl
+import resource
+import hmac
+import shutil
+import stat
+import secrets
 from urllib.parse import quote
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import asynccontextmanager, suppress
-from datetime import datetime, timedelta, timezone
+from dataclasses import dataclass
+from functools import partial
+from datetime import datetime, timezone
+from email.utils import formatdate, parsedate_to_datetime
 from pathlib import Path
 
 import filetype
 from fastapi import FastAPI, File, UploadFile, HTTPException, Request, Query
-from fastapi.responses import HTMLResponse, FileResponse, JSONResponse, RedirectResponse, PlainTextResponse
+from fastapi.responses import HTMLResponse, FileResponse, JSONResponse, RedirectResponse, PlainTextResponse, Response, StreamingResponse
+from starlette.datastructures import Headers
+from python_multipart import MultipartParser
+from python_multipart.exceptions import MultipartParseError
+from python_multipart.multipart import parse_options_header
 from uvicorn.middleware.proxy_headers import ProxyHeadersMiddleware
-from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.middleware.trustedhost import TrustedHostMiddleware
 
 # -----------------
 # Konfiguration
@@ -24,7 +42,10 @@ from starlette.middleware.trustedhost import TrustedHostMiddleware
 DATA_ROOT = Path(os.environ.get("DATA_ROOT", "data"))
 IMAGES_DIR = DATA_ROOT / "images"
 FILES_DIR = DATA_ROOT / "files"
-for d in (IMAGES_DIR, FILES_DIR):
+BLOBS_DIR = DATA_ROOT / "blobs"
+SESSIONS_DIR = DATA_ROOT / "sessions"
+STAGING_DIR = DATA_ROOT / "staging"  # laufende Uploads; gleiches Dateisystem, damit rename atomar bleibt
+for d in (IMAGES_DIR, FILES_DIR, BLOBS_DIR, SESSIONS_DIR, STAGING_DIR):
     d.mkdir(parents=True, exist_ok=True)
 
 # Pfad zum Icon (liegt neben diesem Script)
@@ -35,8 +56,50 @@ LOGO_PATH = APP_DIR / "mini_icon.png"
 TTL_DAYS = int(os.environ.get("TTL_DAYS", "14"))
 CLEANUP_INTERVAL_SECONDS = int(os.environ.get("CLEANUP_INTERVAL_SECONDS", str(6 * 60 * 60)))
 MAX_FILE_MB = int(os.environ.get("MAX_FILE_MB", "15"))
+MAX_BATCH_FILES = int(os.environ.get("MAX_BATCH_FILES", "20"))
+# Admission Control für Uploads: gleichzeitige Uploads, Bytes in Bearbeitung, Warteschlange
+UPLOAD_MAX_CONCURRENT = int(os.environ.get("UPLOAD_MAX_CONCURRENT", "8"))
+UPLOAD_MAX_INFLIGHT_MB = int(os.environ.get("UPLOAD_MAX_INFLIGHT_MB", "256"))
+UPLOAD_QUEUE_SIZE = int(os.environ.get("UPLOAD_QUEUE_SIZE", "32"))
+UPLOAD_QUEUE_TIMEOUT_SECONDS = float(os.environ.get("UPLOAD_QUEUE_TIMEOUT_SECONDS", "10"))
+# Rate-Limit pro Client-IP als "Anzahl/Sekunden" (Token Bucket), leer oder 0 = aus
+RATE_LIMIT_UPLOAD = os.environ.get("RATE_LIMIT_UPLOAD", "30/60")
+RATE_LIMIT_LIST = os.environ.get("RATE_LIMIT_LIST", "120/60")
+RATE_LIMIT_MAX_CLIENTS = int(os.environ.get("RATE_LIMIT_MAX_CLIENTS", "10000"))
+# "memory" (pro Prozess) oder "sqlite" (DATA_ROOT/ratelimit.db, von allen Workern geteilt)
+RATE_LIMIT_BACKEND = os.environ.get("RATE_LIMIT_BACKEND", "memory").strip().lower()
 LANDINGPAGE_TITLE = str(os.environ.get("LANDINGPAGE_TITLE", "Mini image and file server"))
 ALLOWED_HOSTS = [h.strip() for h in os.environ.get("ALLOWED_HOSTS","localhost,127.0.0.1").split(",")]
+# Unvollständige resumable Uploads verfallen nach so vielen Sekunden ohne neuen Chunk
+UPLOAD_SESSION_TTL_SECONDS = int(os.environ.get("UPLOAD_SESSION_TTL_SECONDS", str(24 * 60 * 60)))
+# Gleiche Inhalte nur einmal speichern: jede fid ist ein Hardlink auf blobs/<sha256>
+DEDUP_UPLOADS = os.environ.get("DEDUP_UPLOADS", "1").strip().lower() in ("1", "true", "yes")
+# Threads für blockierende Dateisystem- und Katalogzugriffe aus den async-Handlern
+IO_THREADS = int(os.environ.get("IO_THREADS", "16"))
+# "flat" (alles in einem Verzeichnis) oder "sharded" (images/ab/cd/<fid>.ext, Hash der fid)
+STORAGE_LAYOUT = os.environ.get("STORAGE_LAYOUT", "flat").strip().lower()
+# none: kein fsync, data: Dateiinhalt vor dem Umbenennen per fdatasync, full: zusätzlich Verzeichnis-Einträge und Katalog
+STORAGE_SYNC = os.environ.get("STORAGE_SYNC", "none").strip().lower()
+LAYOUT_MIGRATION_BATCH = int(os.environ.get("LAYOUT_MIGRATION_BATCH", "500"))
+# "uuid4" (zufällig) oder "uuid7" (zeitlich sortiert, Reihenfolge ergibt sich aus der ID)
+ID_SCHEME = os.environ.get("ID_SCHEME", "uuid4").strip().lower()
+# Kleine, häufig abgerufene Bilder aus dem Speicher ausliefern; 0 MB schaltet den Cache ab
+IMAGE_CACHE_MB = int(os.environ.get("IMAGE_CACHE_MB", "64"))
+IMAGE_CACHE_MAX_OBJECT_KB = int(os.environ.get("IMAGE_CACHE_MAX_OBJECT_KB", "512"))
+# Offene fds + stat für zuletzt ausgelieferte Dateien (wie nginx open_file_cache); 0 schaltet ab
+OPEN_FILE_CACHE_SIZE = int(os.environ.get("OPEN_FILE_CACHE_SIZE", "1024"))
+# Blockgröße, wenn Downloads selbst gestreamt werden (Server ohne http.response.pathsend, z. B. uvicorn)
+DOWNLOAD_CHUNK_KB = int(os.environ.get("DOWNLOAD_CHUNK_KB", "256"))
+# Downloads an den Reverse-Proxy abgeben: off, nginx (X-Accel-Redirect) oder sendfile (X-Sendfile, Apache/lighttpd)
+DOWNLOAD_OFFLOAD = os.environ.get("DOWNLOAD_OFFLOAD", "off").strip().lower()
+# Präfix vor dem Pfad relativ zu DATA_ROOT: interne nginx-Location bzw. DATA_ROOT aus Sicht des Proxys
+DOWNLOAD_OFFLOAD_PREFIX = os.environ.get("DOWNLOAD_OFFLOAD_PREFIX", "/_data/" if DOWNLOAD_OFFLOAD == "nginx" else "")
+# Proxy schreibt den Upload-Body selbst auf die Platte (nginx client_body_in_file_only) und reicht nur den Pfad weiter;
+# ohne Token ist das abgeschaltet
+INGEST_TOKEN = os.environ.get("INGEST_TOKEN", "")
+INGEST_DIR = Path(os.environ.get("INGEST_DIR", str(DATA_ROOT / "ingest")))
+if INGEST_TOKEN:
+    INGEST_DIR.mkdir(parents=True, exist_ok=True)
 
 # Erlaubte Typen (nur Magic-Bytes, keine Dateinamen-Heuristik)
 IMAGE_MIME = {"image/jpeg", "image/png", "image/gif", "image/webp"}
@@ -66,39 +129,451 @@ EXT_BY_MIME = {
     "application/x-xz": ".xz",
 }
 
+MIME_BY_IMAGE_EXT = {"jpg":"image/jpeg","jpeg":"image/jpeg","png":"image/png","gif":"image/gif","webp":"image/webp"}
+
 def _now() -> datetime: return datetime.now(timezone.utc)
 
-def _guess(path: Path):
+_io_pool = ThreadPoolExecutor(max_workers=IO_THREADS, thread_name_prefix="io")
+
+async def _io(fn, *args, **kwargs):
+    """Blockierenden Aufruf im begrenzten IO-Pool ausführen, damit der Event-Loop frei bleibt."""
+    return await asyncio.get_running_loop().run_in_executor(_io_pool, partial(fn, *args, **kwargs))
+
+def _guess(path: Path):  # nur noch für den Legacy-Import
     k = filetype.guess(path)
     if not k: return None, None
     return k.mime, k.extension
 
+def _new_fid() -> str:
+    if ID_SCHEME != "uuid7":
+        return uuid.uuid4().hex
+    # RFC 9562 UUIDv7: 48 bit Unix-ms, rand_a = Sub-Millisekunden-Anteil, 62 bit Zufall
+    ns = time.time_ns()
+    ms, sub = divmod(ns, 1_000_000)
+    value = (ms & 0xFFFF_FFFF_FFFF) << 80 | 0x7 << 76 | (sub * 4096 // 1_000_000) << 64
+    value |= 0b10 << 62 | int.from_bytes(os.urandom(8), "big") >> 2
+    return f"{value:032x}"
+
+def _fid_timestamp(fid: str) -> float | None:
+    """Upload-Zeitpunkt aus einer UUIDv7-ID, None für uuid4 und Fremdformate."""
+    if len(fid) != 32 or fid[12] != "7" or fid[16] not in "89ab":
+        return None
+    try:
+        value = int(fid, 16)
+    except ValueError:
+        return None
+    sub = (value >> 64) & 0xFFF
+    return (value >> 80) / 1000 + sub / 4096 / 1000
+
 def _safe_disp_name(name: str) -> str:
     cleaned = re.sub(r'[\r\n\t]', '', name or '')
     return "UTF-8''" + quote(cleaned, safe="!#$&+-.^_`|~ ()[]{}")
 
+# -----------------
+# Katalog (SQLite, WAL) für Bilder und Dateien
+# -----------------
+CATALOG_PATH = DATA_ROOT / "catalog.db"
+
+_CATALOG_SCHEMA = """
+CREATE TABLE IF NOT EXISTS objects (
+    id            TEXT PRIMARY KEY,
+    kind          TEXT NOT NULL,
+    saved_name    TEXT NOT NULL,
+    original_name TEXT,
+    size          INTEGER NOT NULL,
+    mime          TEXT NOT NULL,
+    created       REAL NOT NULL,
+    expiry        REAL NOT NULL,
+    sha256        TEXT
+);
+CREATE INDEX IF NOT EXISTS objects_kind_created ON objects(kind, created, id);
+CREATE INDEX IF NOT EXISTS objects_expiry ON objects(expiry);
+CREATE TABLE IF NOT EXISTS catalog_meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS upload_sessions (
+    id       TEXT PRIMARY KEY,
+    filename TEXT NOT NULL,
+    length   INTEGER NOT NULL,
+    created  REAL NOT NULL,
+    expiry   REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS upload_sessions_expiry ON upload_sessions(expiry);
+CREATE TABLE IF NOT EXISTS upload_chunks (
+    session_id TEXT NOT NULL,
+    start      INTEGER NOT NULL,
+    stop       INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS upload_chunks_session ON upload_chunks(session_id, start);
+"""
+
+_db_local = threading.local()
+
+def _db() -> sqlite3.Connection:
+    # Eine Verbindung pro Thread; WAL erlaubt parallele Leser neben einem Schreiber
+    conn = getattr(_db_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(CATALOG_PATH, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(f"PRAGMA synchronous={'FULL' if STORAGE_SYNC == 'full' else 'NORMAL'}")
+        _db_local.conn = conn
+    return conn
+
+@dataclass(slots=True)
+class IndexEntry:
+    id: str
+    kind: str
+    path: Path
+    original_name: str | None
+    size: int
+    mime: str
+    created: float
+    expiry: float
+    sha256: str | None = None
+
+def _kind_dir(kind: str) -> Path:
+    return IMAGES_DIR if kind == "image" else FILES_DIR
+
+def _entry_from_row(row: sqlite3.Row) -> IndexEntry:
+    return IndexEntry(row["id"], row["kind"], _kind_dir(row["kind"]) / row["saved_name"], row["original_name"],
+                      row["size"], row["mime"], row["created"], row["expiry"], row["sha256"])
+
+def _saved_name(fid: str, ext: str) -> str:
+    """Pfad relativ zu IMAGES_DIR/FILES_DIR gemäß STORAGE_LAYOUT."""
+    name = f"{fid}{ext}"
+    if STORAGE_LAYOUT != "sharded":
+        return name
+    # Hash statt fid-Präfix: UUIDv7-IDs beginnen mit dem Zeitstempel und würden sonst klumpen
+    h = hashlib.blake2b(fid.encode(), digest_size=2).hexdigest()
+    return f"{h[:2]}/{h[2:]}/{name}"
+
+class DirSyncBatcher:
+    """Group-Commit für Verzeichnis-fsyncs: wer wartet, während ein fsync-Durchgang läuft,
+    wird im nächsten Durchgang mitgenommen; jedes Verzeichnis dabei nur einmal.
+    """
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.pending: set[Path] = set()
+        self.cut = 0      # zuletzt abgeschlossene Sammlung
+        self.done = 0     # zuletzt vollständig gesyncte Sammlung
+        self.errors: dict[int, OSError] = {}
+        self.running = False
+        self.batches = 0
+        self.dirs = 0
+
+    def sync(self, *dirs: Path):
+        with self.cond:
+            self.pending.update(dirs)
+            mine = self.cut + 1
+            while self.done < mine:
+                if self.running:
+                    self.cond.wait()
+                    continue
+                batch, self.pending = self.pending, set()
+                self.cut += 1
+                self.running = True
+                self.cond.release()
+                err = None
+                try:
+                    for d in batch:
+                        try:
+                            _fsync_dir(d)
+                        except OSError as e:
+                            err = e
+                finally:
+                    self.cond.acquire()
+                    self.running = False
+                    self.done = self.cut
+                    self.batches += 1
+                    self.dirs += len(batch)
+                    if err is not None:
+                        self.errors[self.done] = err
+                    self.cond.notify_all()
+            if mine in self.errors:
+                raise self.errors[mine]
+
+    def stats(self) -> dict:
+        return {"batches": self.batches, "dirs": self.dirs}
+
+_dir_sync = DirSyncBatcher()
+
+def _fsync_dir(path: Path):
+    fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def _sync_data(fd: int):
+    if STORAGE_SYNC != "none":
+        os.fdatasync(fd)
+
+def _sync_dirs(*dirs: Path):
+    if STORAGE_SYNC == "full":
+        _dir_sync.sync(*dirs)
+
+def _preallocate(fd: int, length: int):
+    """Platz am Stück reservieren (weniger Fragmentierung); Dateisysteme ohne Unterstützung bleiben sparse."""
+    if length > 0 and hasattr(os, "posix_fallocate"):
+        with suppress(OSError): os.posix_fallocate(fd, 0, length)
+
+def _blob_path(sha256: str) -> Path:
+    return BLOBS_DIR / sha256[:2] / sha256[2:4] / sha256
+
+def _link_blob(tmp: Path, dst: Path, sha256: str) -> bool:
+    """dst als Hardlink auf den Blob mit diesem Inhalt anlegen und tmp dabei verbrauchen.
+
+    Ist der Inhalt schon bekannt, wird nur verlinkt und tmp verworfen. False, wenn das Dateisystem
+    keine Hardlinks erlaubt; tmp bleibt dann unangetastet.
+    """
+    blob = _blob_path(sha256)
+    try:
+        blob.parent.mkdir(parents=True, exist_ok=True)
+        os.link(blob, dst)
+    except FileNotFoundError:
+        pass
+    except OSError:
+        return False
+    else:
+        tmp.unlink(missing_ok=True)
+        return True
+    tmp.rename(dst)
+    # Schlägt fehl, wenn ein gleichzeitiger Upload desselben Inhalts schneller war;
+    # dst bleibt dann eine eigenständige Kopie
+    try:
+        os.link(dst, blob)
+    except OSError:
+        pass
+    else:
+        _sync_dirs(blob.parent)
+    return True
+
+def _release_blob(sha256: str | None):
+    """Blob entfernen, sobald keine fid mehr darauf verlinkt (nur noch der Blob selbst)."""
+    if not sha256:
+        return
+    blob = _blob_path(sha256)
+    try:
+        if blob.stat().st_nlink <= 1:
+            blob.unlink(missing_ok=True)
+    except FileNotFoundError:
+        pass
+
+BLOB_SWEEP_GRACE_SECONDS = 3600
+
+def _sweep_blobs():
+    """Blobs ohne verlinkte fid entfernen, die _release_blob verpasst hat.
+
+    Das passiert nach einem Absturz zwischen Löschen und Freigabe oder wenn eine fid während der Schonfrist
+    der Layout-Migration abläuft und den alten Pfad erst _unlink_migrated entfernt. ctime ändert sich mit
+    jedem link/unlink; erst nach der Schonfrist ohne Änderung gilt ein Blob mit st_nlink == 1 als verwaist.
+    """
+    now = time.time()
+    for blob in BLOBS_DIR.glob("*/*/*"):
+        with suppress(OSError):
+            st = blob.stat()
+            if st.st_nlink == 1 and now - st.st_ctime > BLOB_SWEEP_GRACE_SECONDS:
+                blob.unlink()
+                for parent in (blob.parent, blob.parent.parent):
+                    parent.rmdir()
+
+def _storage_path(kind: str, fid: str, ext: str) -> Path:
+    dst = _kind_dir(kind) / _saved_name(fid, ext)
+    if dst.parent != _kind_dir(kind):
+        dst.parent.mkdir(parents=True, exist_ok=True)
+    return dst
+
+def _catalog_insert(fid: str, kind: str, path: Path, original_name: str | None, mime: str, size: int,
+                    sha256: str | None = None) -> IndexEntry:
+    created = _fid_timestamp(fid) or time.time()
+    entry = IndexEntry(fid, kind, path, original_name, size, mime, created, created + TTL_DAYS * 86400, sha256)
+    _db().execute(
+        "INSERT OR REPLACE INTO objects (id, kind, saved_name, original_name, size, mime, created, expiry, sha256)"
+        " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        (fid, kind, path.relative_to(_kind_dir(kind)).as_posix(), original_name, entry.size, mime, entry.created,
+         entry.expiry, sha256))
+    return entry
+
+def _catalog_import_legacy():
+    """Einmaliger Import der bisherigen Verzeichnisse und {fid}.json-Sidecars in den Katalog."""
+    conn = _db()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        if conn.execute("SELECT 1 FROM catalog_meta WHERE key = 'legacy_import'").fetchone():
+            conn.execute("COMMIT")
+            return
+        sidecars, payloads = {}, {}
+        for p in FILES_DIR.iterdir():
+            if not p.is_file(): continue
+            if p.suffix.lower() == ".json": sidecars[p.stem] = p
+            else: payloads[p.stem] = p
+        for fid, p in payloads.items():
+            meta = {}
+            if fid in sidecars:
+                with suppress(Exception): meta = json.loads(sidecars[fid].read_text(encoding="utf-8"))
+            mime, _ = _guess(p)
+            mime = mime or mimetypes.guess_type(p.name)[0] or "application/octet-stream"
+            st = p.stat()
+            created = _fid_timestamp(fid) or st.st_mtime
+            conn.execute(
+                "INSERT OR IGNORE INTO objects (id, kind, saved_name, original_name, size, mime, created, expiry)"
+                " VALUES (?, 'file', ?, ?, ?, ?, ?, ?)",
+                (fid, p.name, meta.get("original_name"), st.st_size, mime, created, created + TTL_DAYS * 86400))
+        for p in IMAGES_DIR.iterdir():
+            if not p.is_file(): continue
+            st = p.stat()
+            created = _fid_timestamp(p.stem) or st.st_mtime
+            mime = MIME_BY_IMAGE_EXT.get(p.suffix.lower().lstrip("."), "application/octet-stream")
+            conn.execute(
+                "INSERT OR IGNORE INTO objects (id, kind, saved_name, original_name, size, mime, created, expiry)"
+                " VALUES (?, 'image', ?, NULL, ?, ?, ?, ?)",
+                (p.stem, p.name, st.st_size, mime, created, created + TTL_DAYS * 86400))
+        conn.execute("INSERT INTO catalog_meta (key, value) VALUES ('legacy_import', ?)", (_now().isoformat(),))
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    # Sidecars erst nach erfolgreichem Commit entfernen
+    for meta in sidecars.values():
+        meta.unlink(missing_ok=True)
+
+def _catalog_migrate():
+    # Spalten, die nach dem ersten Schema dazugekommen sind
+    cols = {r["name"] for r in _db().execute("PRAGMA table_info(objects)")}
+    if "sha256" not in cols:
+        _db().execute("ALTER TABLE objects ADD COLUMN sha256 TEXT")
+
+def _catalog_init():
+    _db().executescript(_CATALOG_SCHEMA)
+    _catalog_migrate()
+    _catalog_import_legacy()
+    # TTL_DAYS kann sich zwischen zwei Starts ändern
+    _db().execute("UPDATE objects SET expiry = created + ? WHERE expiry != created + ?",
+                  (TTL_DAYS * 86400, TTL_DAYS * 86400))
+
+# -----------------
+# Index (fid -> Katalogeintrag), read-through über den Katalog
+# -----------------
+_index: dict[str, IndexEntry] = {}
+
+def _build_index():
+    rows = _db().execute("SELECT * FROM objects").fetchall()
+    _index.clear()
+    _index.update((r["id"], _entry_from_row(r)) for r in rows)
+
+def _lookup(fid: str, kind: str | None = None) -> IndexEntry | None:
+    entry = _index.get(fid)
+    if entry is None:
+        # Upload aus einem anderen Worker-Prozess
+        row = _db().execute("SELECT * FROM objects WHERE id = ?", (fid,)).fetchone()
+        if row is None:
+            return None
+        entry = _index[fid] = _entry_from_row(row)
+    if entry.expiry < _now().timestamp():
+        _index.pop(fid, None)
+        return None
+    if kind is not None and entry.kind != kind:
+        return None
+    return entry
+
+def _forget(fid: str):
+    _index.pop(fid, None)
+
+def _lookup_stat(fid: str, kind: str) -> tuple[IndexEntry, os.stat_result] | tuple[None, None]:
+    entry = _lookup(fid, kind)
+    if entry is None:
+        return None, None
+    try:
+        return entry, entry.path.stat()
+    except FileNotFoundError:
+        pass
+    # Eintrag im Cache veraltet (z. B. durch die Layout-Migration eines anderen Workers verschoben)
+    _forget(fid)
+    entry = _lookup(fid, kind)
+    if entry is None:
+        return None, None
+    try:
+        return entry, entry.path.stat()
+    except FileNotFoundError:
+        return None, None
+
+# -----------------
+# Online-Migration zwischen flachem und gesharded Layout
+# -----------------
+def _migrate_batch() -> list[Path] | None:
+    where = "saved_name NOT LIKE '%/%'" if STORAGE_LAYOUT == "sharded" else "saved_name LIKE '%/%'"
+    # Abgelaufene Einträge überspringen; sonst landen sie bei jedem Durchgang wieder im Batch
+    rows = _db().execute(f"SELECT * FROM objects WHERE {where} AND expiry >= ? LIMIT ?",
+                         (_now().timestamp(), LAYOUT_MIGRATION_BATCH)).fetchall()
+    if not rows:
+        return None
+    moved = []
+    for row in rows:
+        old = _kind_dir(row["kind"]) / row["saved_name"]
+        new = _storage_path(row["kind"], row["id"], old.suffix)
+        try:
+            os.link(old, new)
+        except FileExistsError:
+            pass
+        except FileNotFoundError:
+            if not new.exists():
+                # Datei fehlt ganz: Katalogeintrag gleich entfernen, wie es der Cleanup täte
+                _delete_object(_entry_from_row(row))
+                continue
+        _db().execute("UPDATE objects SET saved_name = ? WHERE id = ?",
+                      (new.relative_to(_kind_dir(row["kind"])).as_posix(), row["id"]))
+        _forget(row["id"])
+        moved.append(old)
+    return moved
+
+def _unlink_migrated(moved: list[Path]):
+    for old in moved:
+        old.unlink(missing_ok=True)
+        # Leere Shard-Verzeichnisse (ab/cd) wieder entfernen
+        for parent in (old.parent, old.parent.parent):
+            if parent in (IMAGES_DIR, FILES_DIR, DATA_ROOT): break
+            with suppress(OSError): parent.rmdir()
+
+async def migrate_layout_loop(grace_seconds: float = 5.0):
+    # Neue Pfade werden zuerst verlinkt und im Katalog eingetragen; die alten erst nach einer
+    # Schonfrist entfernt, damit laufende Downloads mit dem alten Pfad nicht ins Leere greifen.
+    while (moved := await _io(_migrate_batch)) is not None:
+        if not moved:
+            continue
+        await asyncio.sleep(grace_seconds)
+        await _io(_unlink_migrated, moved)
+
 # -----------------
 # Lifespan + Cleanup
 # -----------------
+def _delete_object(entry: IndexEntry):
+    entry.path.unlink(missing_ok=True)
+    _release_blob(entry.sha256)
+    _db().execute("DELETE FROM objects WHERE id = ?", (entry.id,))
+    _forget(entry.id)
+    _image_cache.discard(entry.id)
+    _fd_cache.discard(entry.id)  # sonst hielte der offene fd den Speicherplatz der gelöschten Datei
+
+def _cleanup_expired():
+    rows = _db().execute("SELECT * FROM objects WHERE expiry < ?", (_now().timestamp(),)).fetchall()
+    for row in rows:
+        _delete_object(_entry_from_row(row))
+
+def _sweep_caches():
+    # Hat ein anderer Worker die Datei gelöscht, findet _cleanup_expired hier keine Zeile mehr;
+    # die Caches dieses Prozesses müssen abgelaufene bzw. gelöschte Einträge selbst erkennen
+    now = _now().timestamp()
+    _image_cache.sweep(now)
+    _fd_cache.sweep(now)
+
 async def cleanup_loop():
     while True:
         try:
-            cutoff = _now() - timedelta(days=TTL_DAYS)
-            for folder in (IMAGES_DIR, FILES_DIR):
-                for p in folder.iterdir():
-                    try:
-                        if p.is_file() and datetime.fromtimestamp(p.stat().st_mtime, timezone.utc) < cutoff:
-                            if folder is FILES_DIR and p.suffix.lower() != ".json":
-                                (FILES_DIR / f"{p.stem}.json").unlink(missing_ok=True)
-                            p.unlink(missing_ok=True)
-                    except FileNotFoundError:
-                        pass
-            for meta in FILES_DIR.glob("*.json"):
-                fid = meta.stem
-                exists = any(q for q in FILES_DIR.iterdir()
-                             if q.is_file() and q.stem == fid and q.suffix.lower() != ".json")
-                if not exists:
-                    meta.unlink(missing_ok=True)
+            await _io(_cleanup_expired)
+            await _io(_sweep_caches)
+            await _io(_cleanup_sessions)
+            await _io(_sweep_staging)
+            await _io(_sweep_blobs)
         except Exception:
             pass
         await asyncio.sleep(CLEANUP_INTERVAL_SECONDS)
@@ -110,52 +585,417 @@ async def lifespan(app: FastAPI):
     missing = allowed - set(EXT_BY_MIME.keys())
     if missing:
         raise RuntimeError(f"EXT_BY_MIME fehlt für: {', '.join(sorted(missing))}")
-    task = asyncio.create_task(cleanup_loop())
+    if DOWNLOAD_OFFLOAD not in ("off", "nginx", "sendfile"):
+        raise RuntimeError(f"DOWNLOAD_OFFLOAD muss off, nginx oder sendfile sein, nicht {DOWNLOAD_OFFLOAD!r}")
+    if STORAGE_SYNC not in ("none", "data", "full"):
+        raise RuntimeError(f"STORAGE_SYNC muss none, data oder full sein, nicht {STORAGE_SYNC!r}")
+    _catalog_init()
+    _build_index()
+    _sweep_staging()  # Reste eines abgestürzten Prozesses sofort wegräumen, nicht erst nach CLEANUP_INTERVAL
+    tasks = [asyncio.create_task(cleanup_loop()), asyncio.create_task(migrate_layout_loop())]
     try:
         yield
     finally:
-        task.cancel()
-        with suppress(asyncio.CancelledError): await task
+        for task in tasks:
+            task.cancel()
+            with suppress(asyncio.CancelledError): await task
 
 
 app = FastAPI(title="mini-image-file-server", lifespan=lifespan)
-app.add_middleware(TrustedHostMiddleware, allowed_hosts=ALLOWED_HOSTS)
-app.add_middleware(ProxyHeadersMiddleware, trusted_hosts=["10.0.0.0/8", "127.0.0.1", "172.16.0.0/12", "192.168.0.0/16"])
 
-# --- Security Headers Middleware ---
-class SecurityHeadersMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request, call_next):
-        resp = await call_next(request)
-        if "X-Content-Type-Options" not in resp.headers:
-            resp.headers["X-Content-Type-Options"] = "nosniff"
-        if "Referrer-Policy" not in resp.headers:
-            resp.headers["Referrer-Policy"] = "strict-origin-when-cross-origin"
-        if "X-Frame-Options" not in resp.headers:
-            resp.headers["X-Frame-Options"] = "DENY"
+# --- Body-Größenlimit für Upload-Routen (vor dem Multipart-Parsing) ---
+MULTIPART_OVERHEAD = 64 * 1024  # Boundary + Part-Header
+
+def _upload_body_limits() -> list[tuple[str, re.Pattern, int]]:
+    max_bytes = MAX_FILE_MB * 1024 * 1024
+    return [
+        ("POST", re.compile(r"^/upload$"), max_bytes + MULTIPART_OVERHEAD),
+        ("POST", re.compile(r"^/upload/batch$"), MAX_BATCH_FILES * (max_bytes + MULTIPART_OVERHEAD)),
+        ("PUT", re.compile(r"^/upload/[^/]+$"), max_bytes),
+        ("PUT", re.compile(r"^/uploads/[^/]+$"), max_bytes),
+        ("POST", re.compile(r"^/upload/[^/]+$"), max_bytes),
+    ]
+
+def _match_limit(limits, scope) -> int | None:
+    for method, pattern, limit in limits:
+        if scope["method"] == method and pattern.match(scope["path"]):
+            return limit
+    return None
+
+class BodySizeLimitMiddleware:
+    """Bricht Uploads mit 413 ab, sobald Content-Length oder die gestreamte Bytezahl das Limit übersteigt."""
+
+    def __init__(self, app, limits):
+        self.app = app
+        self.limits = limits
+
+    async def _reject(self, scope, receive, send, limit: int):
+        resp = JSONResponse({"detail": f"request body too large (> {limit} bytes)"}, status_code=413,
+                            headers={"Connection": "close"})
+        await resp(scope, receive, send)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        limit = _match_limit(self.limits, scope)
+        if limit is None:
+            return await self.app(scope, receive, send)
+
+        for name, value in scope["headers"]:
+            if name == b"content-length":
+                try:
+                    if int(value) > limit:
+                        return await self._reject(scope, receive, send, limit)
+                except ValueError:
+                    pass
+                break
+
+        received = 0
+        rejected = False
+
+        async def guarded_receive():
+            nonlocal received, rejected
+            if rejected:
+                return {"type": "http.disconnect"}
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    # Antwort sofort senden; die App sieht danach nur noch einen Disconnect
+                    rejected = True
+                    await self._reject(scope, receive, send, limit)
+                    return {"type": "http.disconnect"}
+            return message
+
+        async def guarded_send(message):
+            if not rejected:
+                await send(message)
+
         try:
-            if request.url.scheme == "https" and "Strict-Transport-Security" not in resp.headers:
-                resp.headers["Strict-Transport-Security"] = "max-age=31536000; includeSubDomains"
-        except Exception: pass
-        ctype = str(resp.headers.get("content-type","")).lower()
-        if ctype.startswith("text/html"):
-            if "Content-Security-Policy" not in resp.headers:
-                resp.headers["Content-Security-Policy"] = (
-                    "default-src 'none'; script-src 'self' 'unsafe-inline'; "
-                    "connect-src 'self'; img-src 'self' data:; style-src 'self' 'unsafe-inline'; "
-                    "base-uri 'none'; frame-ancestors 'none'; object-src 'none'"
-                )
-            resp.headers.setdefault("Cross-Origin-Opener-Policy", "same-origin")
-            resp.headers.setdefault("X-Robots-Tag", "noindex, nofollow")
-        return resp
+            await self.app(scope, guarded_receive, guarded_send)
+        except Exception:
+            if not rejected:
+                raise
+
+# --- Admission Control für Uploads ---
+class UploadOverloaded(Exception):
+    pass
+
+class UploadAdmission:
+    """FIFO-Zulassung nach Anzahl gleichzeitiger Uploads und Summe ihrer (angekündigten) Bytes."""
+
+    def __init__(self, max_concurrent: int, max_bytes: int, queue_size: int, timeout: float):
+        self.max_concurrent = max_concurrent
+        self.max_bytes = max_bytes
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.active = 0
+        self.active_bytes = 0
+        self.waiters = collections.deque()
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def _fits(self, weight: int) -> bool:
+        if self.active >= self.max_concurrent:
+            return False
+        # Ein einzelner Upload darf das Byte-Budget allein ausschöpfen
+        return self.active == 0 or self.active_bytes + weight <= self.max_bytes
+
+    def _take(self, weight: int):
+        self.active += 1
+        self.active_bytes += weight
+
+    async def acquire(self, weight: int):
+        t0 = time.monotonic()
+        if not self.waiters and self._fits(weight):
+            self._take(weight)
+        else:
+            if len(self.waiters) >= self.queue_size:
+                self.rejected += 1
+                raise UploadOverloaded()
+            fut = asyncio.get_running_loop().create_future()
+            waiter = (fut, weight)
+            self.waiters.append(waiter)
+            try:
+                await asyncio.wait_for(asyncio.shield(fut), self.timeout)
+            except BaseException as e:
+                with suppress(ValueError): self.waiters.remove(waiter)
+                if fut.done() and not fut.cancelled():
+                    # Slot wurde im selben Moment zugeteilt: gleich wieder freigeben
+                    self.release(weight)
+                fut.cancel()
+                if isinstance(e, asyncio.TimeoutError):
+                    self.timed_out += 1
+                    raise UploadOverloaded()
+                raise
+        waited = time.monotonic() - t0
+        self.admitted += 1
+        self.wait_total += waited
+        self.wait_max = max(self.wait_max, waited)
+
+    def release(self, weight: int):
+        self.active -= 1
+        self.active_bytes -= weight
+        while self.waiters and self._fits(self.waiters[0][1]):
+            fut, w = self.waiters.popleft()
+            if fut.done():
+                continue
+            self._take(w)
+            fut.set_result(None)
+
+    def stats(self) -> dict:
+        return {
+            "active": self.active,
+            "active_bytes": self.active_bytes,
+            "queued": len(self.waiters),
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "wait_ms_avg": round(self.wait_total / self.admitted * 1000, 2) if self.admitted else 0.0,
+            "wait_ms_max": round(self.wait_max * 1000, 2),
+        }
+
+_upload_admission = UploadAdmission(UPLOAD_MAX_CONCURRENT, UPLOAD_MAX_INFLIGHT_MB * 1024 * 1024,
+                                    UPLOAD_QUEUE_SIZE, UPLOAD_QUEUE_TIMEOUT_SECONDS)
+
+class UploadAdmissionMiddleware:
+    """Lässt Upload-Requests erst durch, wenn Slots frei sind; sonst kurz warten oder 503 + Retry-After."""
+
+    def __init__(self, app, limits, admission: UploadAdmission):
+        self.app = app
+        self.limits = limits
+        self.admission = admission
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        limit = _match_limit(self.limits, scope)
+        if limit is None:
+            return await self.app(scope, receive, send)
+        weight = limit
+        for name, value in scope["headers"]:
+            if name == b"content-length":
+                with suppress(ValueError): weight = min(int(value), limit)
+                break
+        try:
+            await self.admission.acquire(weight)
+        except UploadOverloaded:
+            retry = max(1, int(self.admission.timeout))
+            resp = JSONResponse({"detail": "too many uploads in progress, retry later"}, status_code=503,
+                                headers={"Retry-After": str(retry)})
+            return await resp(scope, receive, send)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.admission.release(weight)
+
+# --- Rate-Limit pro Client (Token Bucket) ---
+def _parse_rate(value: str) -> tuple[float, float] | None:
+    """"30/60" -> (Kapazität 30, 0.5 Tokens/s); leer oder 0 -> None."""
+    value = (value or "").strip()
+    if not value or value == "0":
+        return None
+    count, _, seconds = value.partition("/")
+    count, seconds = float(count), float(seconds or 1)
+    return (count, count / seconds) if count > 0 and seconds > 0 else None
+
+def _rate_groups() -> list[tuple[str, set[str], re.Pattern, tuple[float, float]]]:
+    groups = [
+        # Chunks und Finalize resumable Uploads zählen nicht extra, nur das Anlegen der Session
+        ("upload", {"POST", "PUT"}, re.compile(r"^/upload(/[^/]+)?$"), _parse_rate(RATE_LIMIT_UPLOAD)),
+        ("upload", {"POST"}, re.compile(r"^/uploads$"), _parse_rate(RATE_LIMIT_UPLOAD)),
+        ("list", {"GET"}, re.compile(r"^/list/"), _parse_rate(RATE_LIMIT_LIST)),
+    ]
+    return [g for g in groups if g[3] is not None]
+
+class MemoryBuckets:
+    """Token Buckets pro Schlüssel, LRU-begrenzt. Ein verdrängter Bucket war ohnehin am längsten voll."""
+    blocking = False
+
+    def __init__(self, max_keys: int):
+        self.max_keys = max_keys
+        self.buckets: collections.OrderedDict[str, tuple[float, float]] = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self.buckets)
+
+    def take(self, key: str, capacity: float, rate: float, now: float) -> float:
+        """Ein Token nehmen; 0.0 wenn erlaubt, sonst Sekunden bis zum nächsten Token."""
+        tokens, last = self.buckets.pop(key, (capacity, now))
+        tokens = min(capacity, tokens + (now - last) * rate)
+        wait = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            wait = (1 - tokens) / rate
+        self.buckets[key] = (tokens, now)
+        if len(self.buckets) > self.max_keys:
+            self.buckets.popitem(last=False)
+        return wait
+
+class SqliteBuckets:
+    """Wie MemoryBuckets, aber in einer SQLite-Datei, damit sich alle Worker ein Limit teilen."""
+    blocking = True
+
+    def __init__(self, path: Path, max_keys: int):
+        self.path = path
+        self.max_keys = max_keys
+        self._local = threading.local()
+        self._takes = 0
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")
+            conn.execute("CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL NOT NULL, last REAL NOT NULL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS buckets_last ON buckets(last)")
+            self._local.conn = conn
+        return conn
+
+    def __len__(self):
+        return self._conn().execute("SELECT COUNT(*) FROM buckets").fetchone()[0]
+
+    def take(self, key: str, capacity: float, rate: float, now: float) -> float:
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT tokens, last FROM buckets WHERE key = ?", (key,)).fetchone()
+            tokens, last = row if row else (capacity, now)
+            tokens = min(capacity, tokens + (now - last) * rate)
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / rate
+            conn.execute("INSERT OR REPLACE INTO buckets (key, tokens, last) VALUES (?, ?, ?)", (key, tokens, now))
+            self._takes += 1
+            if self._takes % 1000 == 0:
+                # Über max_keys hinaus die am längsten unbenutzten Buckets verwerfen
+                conn.execute("DELETE FROM buckets WHERE key IN (SELECT key FROM buckets ORDER BY last DESC LIMIT -1 OFFSET ?)",
+                             (self.max_keys,))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return wait
+
+class RateLimitMiddleware:
+    """429 + Retry-After, wenn eine Client-IP ihr Kontingent für die Routengruppe aufgebraucht hat."""
+
+    def __init__(self, app, groups, buckets, counters: dict):
+        self.app = app
+        self.groups = groups
+        self.buckets = buckets
+        self.counters = counters
+
+    def _group(self, scope):
+        for name, methods, pattern, rate in self.groups:
+            if scope["method"] in methods and pattern.match(scope["path"]):
+                return name, rate
+        return None, None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        name, rate = self._group(scope)
+        if name is None:
+            return await self.app(scope, receive, send)
+        client = scope.get("client")
+        key = f"{name}:{client[0] if client else 'unknown'}"
+        capacity, per_second = rate
+        if self.buckets.blocking:
+            wait = await _io(self.buckets.take, key, capacity, per_second, time.time())
+        else:
+            wait = self.buckets.take(key, capacity, per_second, time.time())
+        if wait > 0:
+            self.counters["limited"] += 1
+            resp = JSONResponse({"detail": "rate limit exceeded"}, status_code=429,
+                                headers={"Retry-After": str(math.ceil(wait))})
+            return await resp(scope, receive, send)
+        self.counters["allowed"] += 1
+        await self.app(scope, receive, send)
+
+if RATE_LIMIT_BACKEND == "sqlite":
+    _rate_buckets = SqliteBuckets(DATA_ROOT / "ratelimit.db", RATE_LIMIT_MAX_CLIENTS)
+else:
+    _rate_buckets = MemoryBuckets(RATE_LIMIT_MAX_CLIENTS)
+_rate_limit_counters = {"allowed": 0, "limited": 0}
+
+# --- Security Headers Middleware ---
+class SecurityHeadersMiddleware:
+    """Sicherheits-Header direkt in http.response.start ergänzen (reines ASGI, Bodies laufen unverändert durch).
+
+    Mit allowed_hosts prüft dieselbe Schicht auch den Host-Header wie TrustedHostMiddleware.
+    """
+    COMMON = [(b"x-content-type-options", b"nosniff"),
+              (b"referrer-policy", b"strict-origin-when-cross-origin"),
+              (b"x-frame-options", b"DENY")]
+    HSTS = (b"strict-transport-security", b"max-age=31536000; includeSubDomains")
+    HTML = [(b"content-security-policy",
+             b"default-src 'none'; script-src 'self' 'unsafe-inline'; "
+             b"connect-src 'self'; img-src 'self' data:; style-src 'self' 'unsafe-inline'; "
+             b"base-uri 'none'; frame-ancestors 'none'; object-src 'none'"),
+            (b"cross-origin-opener-policy", b"same-origin"),
+            (b"x-robots-tag", b"noindex, nofollow")]
+
+    def __init__(self, app, allowed_hosts: list[str] | None = None):
+        self.app = app
+        self.allowed_hosts = None if allowed_hosts is None or "*" in allowed_hosts else list(allowed_hosts)
+
+    def _host_allowed(self, scope) -> bool:
+        host = ""
+        for k, v in scope["headers"]:
+            if k == b"host":
+                host = v.decode("latin-1").split(":")[0]
+                break
+        return any(host == p or (p.startswith("*") and host.endswith(p[1:])) for p in self.allowed_hosts)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] not in ("http", "websocket"):
+            return await self.app(scope, receive, send)
+
+        async def send_with_headers(message):
+            if message["type"] == "http.response.start":
+                headers = message.get("headers", [])
+                present = {k.lower() for k, _ in headers}
+                extra = [h for h in self.COMMON if h[0] not in present]
+                # scheme erst hier lesen: ProxyHeadersMiddleware (weiter innen) hat ihn dann schon gesetzt
+                if scope.get("scheme") == "https" and self.HSTS[0] not in present:
+                    extra.append(self.HSTS)
+                ctype = next((v for k, v in headers if k.lower() == b"content-type"), b"")
+                if ctype.lower().startswith(b"text/html"):
+                    extra += [h for h in self.HTML if h[0] not in present]
+                if extra:
+                    message = {**message, "headers": [*headers, *extra]}
+            await send(message)
+
+        # auch die Ablehnung bekommt die Header
+        if self.allowed_hosts is not None and not self._host_allowed(scope):
+            return await PlainTextResponse("Invalid host header", status_code=400)(scope, receive, send_with_headers)
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        await self.app(scope, receive, send_with_headers)
 
-app.add_middleware(SecurityHeadersMiddleware)
+# --- Middleware-Stack (zuletzt hinzugefügt = außen) ---
+# Host-Prüfung + Security-Header -> echte Client-IP -> Rate-Limit -> Größenlimit -> Admission -> App.
+# Das Größenlimit lehnt zu große Bodies ab, bevor sie einen Admission-Slot belegen.
+app.add_middleware(UploadAdmissionMiddleware, limits=_upload_body_limits(), admission=_upload_admission)
+app.add_middleware(BodySizeLimitMiddleware, limits=_upload_body_limits())
+app.add_middleware(RateLimitMiddleware, groups=_rate_groups(), buckets=_rate_buckets, counters=_rate_limit_counters)
+app.add_middleware(ProxyHeadersMiddleware, trusted_hosts=["10.0.0.0/8", "127.0.0.1", "172.16.0.0/12", "192.168.0.0/16"])
+app.add_middleware(SecurityHeadersMiddleware, allowed_hosts=ALLOWED_HOSTS)
 
 # -----------------
 # Static Assets
 # -----------------
 @app.get("/assets/zip_icon.png")
 async def static_zip_icon():
-    if not ZIP_ICON_PATH.exists():
+    if not await _io(ZIP_ICON_PATH.exists):
         raise HTTPException(404, "zip_icon.png not found next to the script")
     resp = FileResponse(ZIP_ICON_PATH, media_type="image/png")
     resp.headers["Cache-Control"] = "public, max-age=604800, immutable"
@@ -163,7 +1003,7 @@ async def static_zip_icon():
 
 @app.get("/assets/logo.png")
 async def static_logo():
-    if not LOGO_PATH.exists():
+    if not await _io(LOGO_PATH.exists):
         raise HTTPException(404, "logo.png not found next to the script")
     resp = FileResponse(LOGO_PATH, media_type="image/png")
     resp.headers["Cache-Control"] = "public, max-age=604800, immutable"
@@ -229,7 +1069,7 @@ async def root() -> str:
       <div id='drop' class='uploader'>
         <p>Drag & Drop files here or <label for='file' class='btn'>Select File</label></p>
         <p class='muted'>Images: JPG/PNG/GIF/WEBP · Files: ZIP/TAR/RAR/7Z · max. {MAX_FILE_MB} MB</p>
-        <input id='file' type='file' />
+        <input id='file' type='file' multiple />
         <progress id='prog' value='0' max='100' style='display:none'></progress>
       </div>
     </div>
@@ -257,28 +1097,34 @@ const btnNext=document.getElementById('next');
 const pagerInfo=document.getElementById('pager-info');
 let current='images';
 const PER_PAGE=15;
-const page={{ images:1, files:1 }};
-let totalPages={{ images:1, files:1 }};
+// Cursor-Stack pro Tab: letzter Eintrag = Cursor der aktuellen Seite ('' = erste Seite)
+const cursors={{ images:[''], files:[''] }};
+let nextCursor={{ images:null, files:null }};
 let totals={{ images:0, files:0 }};
 
 // Clientseitige Maxgröße (aus dem Serverwert)
 const MAX_MB = {MAX_FILE_MB};
 const MAX_BYTES = MAX_MB*1024*1024;
+const MAX_BATCH = {MAX_BATCH_FILES};
 
 tabImg.onclick=()=>{{current='images';tabImg.classList.add('active');tabFiles.classList.remove('active');fetchList();}};
 tabFiles.onclick=()=>{{current='files';tabFiles.classList.add('active');tabImg.classList.remove('active');fetchList();}};
-btnPrev.onclick=()=>{{if(page[current]>1){{page[current]--;fetchList();}}}};
-btnNext.onclick=()=>{{if(page[current]<totalPages[current]){{page[current]++;fetchList();}}}};
+btnPrev.onclick=()=>{{if(cursors[current].length>1){{cursors[current].pop();fetchList();}}}};
+btnNext.onclick=()=>{{if(nextCursor[current]){{cursors[current].push(nextCursor[current]);fetchList();}}}};
+
+function resetPager(){{cursors[current]=[''];}}
 
-function updatePager(meta){{totals[current]=meta.total??0;totalPages[current]=meta.total_pages??1;
-const p=meta.page??1;const per=meta.per_page??PER_PAGE;const start=(p-1)*per+1;const end=Math.min(p*per,totals[current]);
-pagerInfo.textContent=totals[current]?`Page ${{p}}/${{totalPages[current]}} · ${{start}}-${{end}} of ${{totals[current]}}`:'No items';
-btnPrev.disabled=(p<=1);btnNext.disabled=(p>=totalPages[current]);}}
+function updatePager(meta,count){{if(meta.total!==undefined)totals[current]=meta.total;nextCursor[current]=meta.next_cursor??null;
+const p=cursors[current].length;const per=meta.per_page??PER_PAGE;const start=(p-1)*per+1;const end=start+count-1;
+const pages=Math.max(1,Math.ceil(totals[current]/per));
+pagerInfo.textContent=count?`Page ${{p}}/${{Math.max(p,pages)}} · ${{start}}-${{end}} of ${{Math.max(end,totals[current])}}`:'No items';
+btnPrev.disabled=(p<=1);btnNext.disabled=!nextCursor[current];}}
 
 async function fetchList(){{
-  const p=page[current];
-  const url=current==='images'?`/list/images?page=${{p}}&limit=${{PER_PAGE}}`:`/list/files?page=${{p}}&limit=${{PER_PAGE}}`;
-  const r=await fetch(url);const data=await r.json();renderGrid(data.items,current);updatePager(data);
+  const stack=cursors[current];const c=stack[stack.length-1];
+  // Gesamtzahl nur auf Seite 1 abfragen, tiefere Seiten kosten O(limit)
+  const url=`/list/${{current}}?cursor=${{encodeURIComponent(c)}}&limit=${{PER_PAGE}}`+(stack.length===1?'&count=true':'');
+  const r=await fetch(url);const data=await r.json();renderGrid(data.items,current);updatePager(data,data.items.length);
 }}
 
 function renderGrid(items,kind){{grid.innerHTML='';for(const it of items){{
@@ -317,8 +1163,25 @@ function uploadFile(file){{
     return Promise.reject('too large');
   }}
   const fd=new FormData();fd.append('file',file);
+  return postForm('/upload',fd);
+}}
+
+// Mehrere Dateien: ein Request pro MAX_BATCH Dateien über /upload/batch
+async function uploadFiles(list){{
+  const files=[...list];
+  if(files.length===1)return uploadFile(files[0]);
+  const ok=files.filter(f=>f.size<=MAX_BYTES);
+  if(ok.length<files.length)alert(`${{files.length-ok.length}} Datei(en) größer als ${{MAX_MB}} MB werden übersprungen`);
+  if(!ok.length)throw 'too large';
+  for(let i=0;i<ok.length;i+=MAX_BATCH){{
+    const fd=new FormData();for(const f of ok.slice(i,i+MAX_BATCH))fd.append('files',f);
+    await postForm('/upload/batch',fd);
+  }}
+}}
+
+function postForm(url,fd){{
   prog.style.display='block';prog.value=0;
-  return new Promise((res,rej)=>{{const xhr=new XMLHttpRequest();xhr.open('POST','/upload');
+  return new Promise((res,rej)=>{{const xhr=new XMLHttpRequest();xhr.open('POST',url);
   xhr.upload.onprogress=e=>{{if(e.lengthComputable)prog.value=(e.loaded/e.total)*100;}};xhr.onload=()=>{{prog.style.display='none';prog.value=0;if(xhr.status>=200&&xhr.status<300)res(JSON.parse(xhr.responseText));else rej(xhr.responseText);}};
   xhr.onerror=()=>{{prog.style.display='none';rej('network error');}};xhr.send(fd);}});
 }}
@@ -326,9 +1189,9 @@ function uploadFile(file){{
 ['dragenter','dragover'].forEach(ev=>drop.addEventListener(ev,e=>{{e.preventDefault();e.stopPropagation();drop.classList.add('drag');}}));
 ['dragleave','drop'].forEach(ev=>drop.addEventListener(ev,e=>{{e.preventDefault();e.stopPropagation();drop.classList.remove('drag');}}));
 drop.addEventListener('drop',async(e)=>{{const f=e.dataTransfer.files;if(!f||!f.length)return;
-try{{await uploadFile(f[0]);page[current]=1;await fetchList();}}catch(err){{/* handled */}}}});
+try{{await uploadFiles(f);resetPager();await fetchList();}}catch(err){{/* handled */}}}});
 fileInput.addEventListener('change',async()=>{{if(!fileInput.files||!fileInput.files.length)return;
-try{{await uploadFile(fileInput.files[0]);fileInput.value='';page[current]=1;await fetchList();}}catch(err){{/* handled */}}}});
+try{{await uploadFiles(fileInput.files);fileInput.value='';resetPager();await fetchList();}}catch(err){{/* handled */}}}});
 
 // Paste-Support (Strg+V) + gleiche Größenprüfung
 document.addEventListener('paste', async (e) => {{
@@ -345,8 +1208,8 @@ document.addEventListener('paste', async (e) => {{
   if (!files.length) return;
   e.preventDefault();
   try {{
-    await uploadFile(files[0]);
-    page[current]=1;
+    await uploadFiles(files);
+    resetPager();
     await fetchList();
   }} catch (err) {{
     /* handled */
@@ -361,100 +1224,668 @@ fetchList();
 # Upload & Klassifikation
 # -----------------
 CHUNK_SIZE = 1024 * 1024  # 1 MiB
+SNIFF_BYTES = 8192  # filetype wertet höchstens die ersten 8 KiB aus
 
-@app.post("/upload")
-async def upload(request: Request, file: UploadFile = File(...)):
-    if not file.filename:
-        raise HTTPException(400, "no filename")
+def _sniff(head: bytes) -> str:
+    """Magic-Bytes des Upload-Anfangs prüfen; nicht erlaubte Typen sofort mit 415 abweisen."""
+    k = filetype.guess(head)
+    if not k:
+        raise HTTPException(415, "unsupported media type")
+    if k.mime not in IMAGE_MIME and k.mime not in ARCHIVE_MIME:
+        raise HTTPException(415, f"media type not allowed: {k.mime}")
+    return k.mime
+
+async def _upload_chunks(file: UploadFile):
+    while True:
+        chunk = await file.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        yield chunk
+
+STAGING_GRACE_SECONDS = 60  # jünger: evtl. gerade fertig geschrieben und noch nicht umbenannt
+
+_staging_swept = {"files": 0, "bytes": 0}
+
+def _open_staging():
+    """Temp-Datei in STAGING_DIR, exklusiv per flock gesperrt, solange sie offen ist.
+
+    Die Sperre verschwindet mit dem Prozess; so erkennt _sweep_staging auch bei mehreren Workern,
+    welche Dateien niemand mehr schreibt.
+    """
+    tmp = STAGING_DIR / f"tmp_{uuid.uuid4().hex}"
+    out = tmp.open("wb")
+    fcntl.flock(out.fileno(), fcntl.LOCK_EX)
+    return tmp, out
+
+def _lock_file(path: Path):
+    f = path.open("rb")
+    fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+    return f
+
+def _orphaned(path: Path, now: float) -> int | None:
+    """Größe einer verwaisten Temp-Datei, sonst None (zu jung oder noch gesperrt)."""
+    try:
+        st = path.stat()
+        if now - st.st_mtime < STAGING_GRACE_SECONDS:
+            return None
+        with path.open("rb") as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        return None
+    return st.st_size
+
+def _sweep_staging():
+    """Verwaiste Temp-Dateien (auch alte DATA_ROOT/tmp_* von vor STAGING_DIR) und Session-Dateien ohne Session löschen."""
+    now = time.time()
+    candidates = [*STAGING_DIR.iterdir(), *DATA_ROOT.glob("tmp_*")]
+    sessions = {row["id"] for row in _db().execute("SELECT id FROM upload_sessions")}
+    candidates += [p for p in SESSIONS_DIR.iterdir() if p.name not in sessions]
+    for path in candidates:
+        size = _orphaned(path, now)
+        if size is None:
+            continue
+        path.unlink(missing_ok=True)
+        _staging_swept["files"] += 1
+        _staging_swept["bytes"] += size
+
+def _staging_usage() -> dict:
+    files = size = 0
+    for d in (STAGING_DIR, SESSIONS_DIR):
+        for p in d.iterdir():
+            with suppress(OSError):
+                size += p.stat().st_blocks * 512  # belegter Platz, nicht die sparse Dateigröße
+                files += 1
+    return {"files": files, "bytes": size, "swept": dict(_staging_swept)}
+
+async def _receive(chunks, max_bytes: int, expected: int | None = None) -> tuple[Path, str, int, str]:
+    """Streamt chunks in eine Temp-Datei. Typ wird nach dem ersten Block geprüft, Größe laufend.
+
+    expected (Content-Length eines rohen Bodys) wird per posix_fallocate reserviert, sobald der Typ feststeht.
+    Liefert (Temp-Datei, erkannter Mime-Typ, Größe, SHA-256); bei Fehlern ist die Temp-Datei bereits entfernt.
+    """
+    tmp, out = await _io(_open_staging)
+    size = 0
+    mime = None
+    pending = bytearray()
+    digest = hashlib.sha256()
+
+    def flush(buf):
+        # Hashen und Schreiben gemeinsam im IO-Pool (hashlib gibt dabei den GIL frei)
+        digest.update(buf)
+        out.write(buf)
+
+    try:
+        async for chunk in chunks:
+            size += len(chunk)
+            if size > max_bytes:
+                # Sofort abbrechen, Temp-Datei wieder löschen
+                raise HTTPException(413, f"file too large (> {MAX_FILE_MB} MB)")
+            pending += chunk
+            if mime is None:
+                if len(pending) < SNIFF_BYTES:
+                    continue
+                mime = _sniff(bytes(pending[:SNIFF_BYTES]))
+                # Erst nach der Typprüfung: ein abgewiesener Body soll keinen Platz reservieren
+                if expected and expected <= max_bytes:
+                    await _io(_preallocate, out.fileno(), expected)
+            # Kleine Stream-Chunks sammeln, damit nicht jeder einzelne einen Thread-Wechsel kostet
+            if len(pending) >= CHUNK_SIZE:
+                buf, pending = pending, bytearray()
+                await _io(flush, buf)
+        if size == 0:
+            raise HTTPException(400, "empty upload")
+        if mime is None:
+            mime = _sniff(bytes(pending))
+        if pending:
+            await _io(flush, pending)
+        await _io(_finish, out, size)
+    except BaseException:
+        await _io(_discard, out, tmp)
+        raise
+    return tmp, mime, size, digest.hexdigest()
 
+def _finish(out, size: int):
+    out.flush()
+    if os.fstat(out.fileno()).st_size != size:
+        out.truncate(size)  # Vorab reservierter Rest, falls der Body kürzer war
+    _sync_data(out.fileno())
+    out.close()
+
+def _discard(out, tmp: Path):
+    with suppress(Exception): out.close()
+    tmp.unlink(missing_ok=True)
+
+def _check_content_length(request: Request, max_bytes: int) -> int | None:
     # Frühe Abweisung per Content-Length (falls vorhanden)
     cl = request.headers.get("content-length")
-    max_bytes = MAX_FILE_MB * 1024 * 1024
     if cl:
         try:
-            if int(cl) > max_bytes:
-                raise HTTPException(413, "too large")
+            length = int(cl)
         except ValueError:
-            pass
+            return None
+        if length > max_bytes:
+            raise HTTPException(413, "too large")
+        return length
+    return None
+
+def _store(tmp: Path, mime: str, size: int, sha256: str, orig_name: str, base: str) -> dict:
+    """Temp-Datei anhand des erkannten Typs nach IMAGES_DIR/FILES_DIR verschieben und katalogisieren."""
+    kind = "image" if mime in IMAGE_MIME else "file"
+    fid = _new_fid()
+    dst = _storage_path(kind, fid, EXT_BY_MIME[mime])
+    if not (DEDUP_UPLOADS and _link_blob(tmp, dst, sha256)):
+        tmp.rename(dst)
+    _sync_dirs(dst.parent)
+    _index[fid] = _catalog_insert(fid, kind, dst, orig_name, mime, size, sha256)
+    if kind == "image":
+        return {
+            "type":"image","id":fid,
+            "page_url":f"{base}/i/{fid}",
+            "raw_url":f"{base}/raw/image/{fid}",
+        }
+    return {
+        "type":"file","id":fid,
+        "page_url":f"{base}/f/{fid}",
+        "raw_url":f"{base}/raw/file/{fid}",
+        "original_name":orig_name,
+    }
+
+@app.post("/upload")
+async def upload(request: Request, file: UploadFile = File(...)):
+    if not file.filename:
+        raise HTTPException(400, "no filename")
+
+    max_bytes = MAX_FILE_MB * 1024 * 1024
+    _check_content_length(request, max_bytes)
 
-    tmp = DATA_ROOT / f"tmp_{uuid.uuid4().hex}"
-    size = 0
     try:
-        with tmp.open("wb") as out:
-            while True:
-                chunk = await file.read(CHUNK_SIZE)
-                if not chunk:
-                    break
-                size += len(chunk)
-                if size > max_bytes:
-                    # Sofort abbrechen, Temp-Datei wieder löschen
-                    raise HTTPException(413, f"file too large (> {MAX_FILE_MB} MB)")
-                out.write(chunk)
-    except HTTPException:
-        tmp.unlink(missing_ok=True)
-        with suppress(Exception): await file.close()
-        raise
-    except Exception:
-        tmp.unlink(missing_ok=True)
+        tmp, mime, size, sha256 = await _receive(_upload_chunks(file), max_bytes)
+    finally:
         with suppress(Exception): await file.close()
+
+    base = str(request.base_url).rstrip("/")
+    return JSONResponse(await _io(_store, tmp, mime, size, sha256, Path(file.filename).name, base))
+
+async def _multipart_events(request: Request):
+    """multipart/form-data direkt aus dem Request-Stream: ("part", (Feldname, Dateiname)), ("data", bytes), ("end", None)."""
+    ctype, params = parse_options_header(request.headers.get("content-type", ""))
+    if ctype != b"multipart/form-data" or not params.get(b"boundary"):
+        raise HTTPException(400, "multipart/form-data required")
+    events = []
+    headers = {}
+    field = []
+    value = []
+    header_bytes = 0
+
+    def on_part_begin():
+        nonlocal header_bytes
+        headers.clear()
+        header_bytes = 0
+
+    def on_header_field(data, start, end):
+        nonlocal header_bytes
+        field.append(data[start:end])
+        header_bytes += end - start
+
+    def on_header_value(data, start, end):
+        nonlocal header_bytes
+        value.append(data[start:end])
+        header_bytes += end - start
+        if header_bytes > MULTIPART_OVERHEAD:
+            raise MultipartParseError("multipart headers too large")
+
+    def on_header_end():
+        headers[b"".join(field).lower()] = b"".join(value)
+        field.clear()
+        value.clear()
+
+    def on_headers_finished():
+        _, opts = parse_options_header(headers.get(b"content-disposition", b""))
+        name = opts.get(b"name", b"").decode("utf-8", "replace")
+        filename = opts[b"filename"].decode("utf-8", "replace") if b"filename" in opts else None
+        events.append(("part", (name, filename)))
+
+    parser = MultipartParser(params[b"boundary"], {
+        "on_part_begin": on_part_begin,
+        "on_part_data": lambda data, start, end: events.append(("data", data[start:end])),
+        "on_part_end": lambda: events.append(("end", None)),
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+    })
+    # Parse-Fehler bleiben MultipartParseError: sie können mitten in einem Part auftreten und dürfen
+    # dann nicht als Fehler dieses einen Parts durchgehen
+    async for chunk in request.stream():
+        parser.write(chunk)
+        batch, events[:] = events[:], []
+        for event in batch:
+            yield event
+    parser.finalize()
+    for event in events:
+        yield event
+
+async def _multipart_files(request: Request, field: str):
+    """(Dateiname, Chunk-Iterator) je Datei-Part im Feld field, in Request-Reihenfolge.
+
+    Liest der Aufrufer einen Part nicht zu Ende, wird sein Rest ungelesen verworfen; andere Felder ebenso.
+    """
+    events = _multipart_events(request)
+
+    async def part_data():
+        async for kind, value in events:
+            if kind == "end":
+                return
+            yield value
+        raise MultipartParseError("multipart body ends inside a part")
+
+    async for kind, value in events:
+        if kind == "part" and value[0] == field and value[1] is not None:
+            yield value[1], part_data()
+
+@app.post("/upload/batch")
+async def upload_batch(request: Request):
+    """Mehrere Dateien (Feld "files") in einem Request; jede läuft durch dieselbe Prüfung wie /upload.
+
+    Die Parts laufen direkt aus dem Request-Stream durch _receive, ohne vorher gespoolt zu werden; ein zu großer
+    Part wird nach max_bytes abgebrochen. Gespeichert wird erst, wenn der ganze Request gelesen ist,
+    damit ein abgewiesener Request (z. B. zu viele Dateien) nichts hinterlässt.
+    """
+    max_bytes = MAX_FILE_MB * 1024 * 1024
+    received = []  # (Dateiname, (Temp-Datei, Sperre, mime, Größe, SHA-256) oder HTTPException)
+    try:
+        async for name, chunks in _multipart_files(request, "files"):
+            # Abbruch beim ersten überzähligen Part, bevor dessen Body gelesen wird
+            if len(received) == MAX_BATCH_FILES:
+                raise HTTPException(413, f"too many files (> {MAX_BATCH_FILES})")
+            name = Path(name).name
+            try:
+                if not name:
+                    raise HTTPException(400, "no filename")
+                tmp, mime, size, sha256 = await _receive(chunks, max_bytes)
+                # Wieder sperren, damit _sweep_staging die fertige Temp-Datei bis zum Speichern in Ruhe lässt
+                received.append((name, (tmp, await _io(_lock_file, tmp), mime, size, sha256)))
+            except HTTPException as e:
+                received.append((name, e))
+        if not received:
+            raise HTTPException(400, "no files")
+    except BaseException as e:
+        for _, r in received:
+            if not isinstance(r, HTTPException):
+                await _io(r[0].unlink, missing_ok=True)
+                await _io(r[1].close)
+        if isinstance(e, MultipartParseError):
+            raise HTTPException(400, "malformed multipart body")
         raise
+    base = str(request.base_url).rstrip("/")
+    items = []
+    try:
+        for name, r in received:
+            if isinstance(r, HTTPException):
+                items.append({"status": r.status_code, "error": r.detail, "original_name": name})
+            else:
+                tmp, _, mime, size, sha256 = r
+                items.append({"status": 200, **await _io(_store, tmp, mime, size, sha256, name, base)})
     finally:
-        with suppress(Exception): await file.close()
+        for _, r in received:
+            if not isinstance(r, HTTPException):
+                await _io(r[1].close)
+    return JSONResponse({"items": items})
 
-    if size == 0:
-        tmp.unlink(missing_ok=True)
+def _check_ingest_token(request: Request):
+    token = request.headers.get("x-ingest-token", "")
+    if not INGEST_TOKEN or not hmac.compare_digest(token.encode(), INGEST_TOKEN.encode()):
+        raise HTTPException(403, "proxy ingestion not allowed")
+
+def _ingest_file(name: str, max_bytes: int) -> tuple[Path, str, int, str]:
+    """Vom Proxy geschriebene Body-Datei übernehmen und wie in _receive prüfen.
+
+    Vom Pfad zählt nur der Dateiname: angenommen wird ausschließlich eine reguläre Datei direkt in INGEST_DIR
+    (der Proxy darf das Verzeichnis unter einem anderen Mountpoint sehen), Symlinks weist O_NOFOLLOW ab.
+    Abgelehnte Dateien werden gelöscht. Liegt INGEST_DIR auf einem anderen Dateisystem, wird nach STAGING_DIR kopiert.
+    """
+    base = Path(name).name
+    if base in ("", ".", ".."):
+        raise HTTPException(403, "upload file not accepted")
+    path = INGEST_DIR / base
+    try:
+        fd = os.open(path, os.O_RDONLY | os.O_NOFOLLOW | os.O_CLOEXEC)
+    except FileNotFoundError:
+        raise HTTPException(400, "upload file not found")
+    except OSError:
+        raise HTTPException(403, "upload file not accepted")
+    try:
+        with os.fdopen(fd, "rb") as f:
+            st = os.fstat(f.fileno())
+            if not stat.S_ISREG(st.st_mode) or st.st_nlink != 1:
+                raise HTTPException(403, "upload file not accepted")
+            if st.st_size > max_bytes:
+                raise HTTPException(413, f"file too large (> {MAX_FILE_MB} MB)")
+            if st.st_size == 0:
+                raise HTTPException(400, "empty upload")
+            mime = _sniff(f.read(SNIFF_BYTES))
+            f.seek(0)
+            sha256 = hashlib.file_digest(f, "sha256").hexdigest()
+            _sync_data(f.fileno())
+            if st.st_dev != os.stat(STAGING_DIR).st_dev:
+                f.seek(0)
+                tmp, out = _open_staging()
+                with out:
+                    shutil.copyfileobj(f, out, CHUNK_SIZE)
+                    out.flush()
+                    _sync_data(out.fileno())
+                path.unlink(missing_ok=True)
+                path = tmp
+    except BaseException:
+        path.unlink(missing_ok=True)
+        raise
+    return path, mime, st.st_size, sha256
+
+# Nach /upload/batch registriert, damit POST /upload/batch nicht hier landet
+@app.api_route("/upload/{filename}", methods=["PUT", "POST"])
+async def upload_raw(request: Request, filename: str):
+    """Roher Request-Body als Datei (z. B. curl -T), ohne Multipart-Spooling.
+
+    Mit X-Upload-File hat der Proxy den Body bereits geschrieben; dann wird nur noch die Datei übernommen.
+    """
+    orig_name = Path(filename).name
+    if not orig_name:
+        raise HTTPException(400, "no filename")
+    max_bytes = MAX_FILE_MB * 1024 * 1024
+    ingest = request.headers.get("x-upload-file")
+    if ingest is not None:
+        _check_ingest_token(request)
+        tmp, mime, size, sha256 = await _io(_ingest_file, ingest, max_bytes)
+    else:
+        expected = _check_content_length(request, max_bytes)
+        tmp, mime, size, sha256 = await _receive(request.stream(), max_bytes, expected)
+    base = str(request.base_url).rstrip("/")
+    return JSONResponse(await _io(_store, tmp, mime, size, sha256, orig_name, base))
+
+# -----------------
+# Resumable Uploads: Session anlegen, Byte-Bereiche parallel per PUT, dann finalisieren
+# -----------------
+_SESSION_ID = re.compile(r"[0-9a-f]{32}")
+
+def _session_path(sid: str) -> Path:
+    # sid kommt aus der URL: nur echte Session-IDs, sonst ließe sich z. B. ".." oder jeder Name in SESSIONS_DIR öffnen
+    if not _SESSION_ID.fullmatch(sid):
+        raise HTTPException(404, "upload session not found")
+    return SESSIONS_DIR / sid
+
+def _session(sid: str) -> sqlite3.Row:
+    row = _db().execute("SELECT * FROM upload_sessions WHERE id = ? AND expiry >= ?", (sid, time.time())).fetchone()
+    if row is None:
+        raise HTTPException(404, "upload session not found")
+    return row
+
+def _session_ranges(sid: str) -> list[tuple[int, int]]:
+    """Empfangene Bereiche als sortierte, zusammengeführte [start, stop)-Liste."""
+    merged = []
+    for start, stop in _db().execute("SELECT start, stop FROM upload_chunks WHERE session_id = ? ORDER BY start", (sid,)):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], stop))
+        else:
+            merged.append((start, stop))
+    return merged
+
+def _session_offset(ranges: list[tuple[int, int]]) -> int:
+    return ranges[0][1] if ranges and ranges[0][0] == 0 else 0
+
+def _create_session(filename: str, length: int) -> str:
+    sid = uuid.uuid4().hex
+    with open(_session_path(sid), "wb") as f:
+        # Chunks landen per pwrite direkt an ihrer Position; bewusst sparse, belegt wird erst, was ankommt
+        f.truncate(length)
+    _sync_dirs(SESSIONS_DIR)
+    now = time.time()
+    _db().execute("INSERT INTO upload_sessions (id, filename, length, created, expiry) VALUES (?, ?, ?, ?, ?)",
+                  (sid, filename, length, now, now + UPLOAD_SESSION_TTL_SECONDS))
+    return sid
+
+UPLOAD_SESSION_MAX_RANGES = 1024  # getrennte Bereiche je Session; lückenlos gesendete Chunks bleiben einer
+
+def _record_chunk(sid: str, start: int, stop: int):
+    """Bereich verbuchen und dabei mit überlappenden oder angrenzenden Zeilen zu einer zusammenfassen."""
+    conn = _db()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        # Abgebrochen, abgelaufen oder schon finalisiert: keine Zeile ohne Session hinterlassen
+        if conn.execute("SELECT 1 FROM upload_sessions WHERE id = ? AND expiry >= ?", (sid, time.time())).fetchone() is None:
+            raise HTTPException(404, "upload session not found")
+        touching = conn.execute("SELECT rowid, start, stop FROM upload_chunks WHERE session_id = ? AND start <= ? AND stop >= ?",
+                                (sid, stop, start)).fetchall()
+        if touching:
+            start = min(start, *(r["start"] for r in touching))
+            stop = max(stop, *(r["stop"] for r in touching))
+            conn.executemany("DELETE FROM upload_chunks WHERE rowid = ?", [(r["rowid"],) for r in touching])
+        elif conn.execute("SELECT COUNT(*) FROM upload_chunks WHERE session_id = ?", (sid,)).fetchone()[0] >= UPLOAD_SESSION_MAX_RANGES:
+            raise HTTPException(400, f"too many separate ranges (> {UPLOAD_SESSION_MAX_RANGES}), fill the gaps first")
+        conn.execute("INSERT INTO upload_chunks (session_id, start, stop) VALUES (?, ?, ?)", (sid, start, stop))
+        conn.execute("UPDATE upload_sessions SET expiry = ? WHERE id = ?", (time.time() + UPLOAD_SESSION_TTL_SECONDS, sid))
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+
+def _drop_session(sid: str):
+    conn = _db()
+    conn.execute("BEGIN IMMEDIATE")
+    conn.execute("DELETE FROM upload_chunks WHERE session_id = ?", (sid,))
+    conn.execute("DELETE FROM upload_sessions WHERE id = ?", (sid,))
+    conn.execute("COMMIT")
+
+def _abort_session(sid: str):
+    _session_path(sid).unlink(missing_ok=True)
+    _drop_session(sid)
+
+def _claim_session(sid: str) -> sqlite3.Row:
+    """Session für das Finalisieren übernehmen; ein zweiter gleichzeitiger Aufruf bekommt 404/409."""
+    conn = _db()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        row = conn.execute("SELECT * FROM upload_sessions WHERE id = ? AND expiry >= ?", (sid, time.time())).fetchone()
+        if row is None:
+            raise HTTPException(404, "upload session not found")
+        ranges = _session_ranges(sid)
+        if ranges != [(0, row["length"])]:
+            raise HTTPException(409, "upload incomplete")
+        conn.execute("DELETE FROM upload_chunks WHERE session_id = ?", (sid,))
+        conn.execute("DELETE FROM upload_sessions WHERE id = ?", (sid,))
+        conn.execute("COMMIT")
+        return row
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+
+def _hash_file(path: Path) -> str:
+    digest = hashlib.sha256()
+    with path.open("rb") as f:
+        while chunk := f.read(CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _read_head(path: Path) -> bytes:
+    with path.open("rb") as f:
+        return f.read(SNIFF_BYTES)
+
+def _cleanup_sessions():
+    rows = _db().execute("SELECT id FROM upload_sessions WHERE expiry < ?", (time.time(),)).fetchall()
+    for row in rows:
+        _abort_session(row["id"])
+    # Reste von Chunks, die vor der Prüfung in _record_chunk verbucht wurden
+    _db().execute("DELETE FROM upload_chunks WHERE session_id NOT IN (SELECT id FROM upload_sessions)")
+
+def _parse_content_range(value: str | None, length: int) -> tuple[int, int]:
+    m = re.fullmatch(r"bytes (\d+)-(\d+)/(\d+|\*)", (value or "").strip())
+    if not m:
+        raise HTTPException(400, "Content-Range: bytes <start>-<end>/<length> required")
+    start, end = int(m.group(1)), int(m.group(2))
+    if m.group(3) != "*" and int(m.group(3)) != length:
+        raise HTTPException(400, "Content-Range length does not match the session")
+    if start > end or end >= length:
+        raise HTTPException(416, "range outside of the upload")
+    return start, end + 1
+
+@app.post("/uploads", status_code=201)
+async def create_upload_session(request: Request, filename: str = Query(...)):
+    orig_name = Path(filename).name
+    if not orig_name:
+        raise HTTPException(400, "no filename")
+    try:
+        length = int(request.headers.get("upload-length", ""))
+    except ValueError:
+        raise HTTPException(400, "Upload-Length header required")
+    if length <= 0:
         raise HTTPException(400, "empty upload")
+    if length > MAX_FILE_MB * 1024 * 1024:
+        raise HTTPException(413, f"file too large (> {MAX_FILE_MB} MB)")
+    sid = await _io(_create_session, orig_name, length)
+    url = f"{str(request.base_url).rstrip('/')}/uploads/{sid}"
+    return JSONResponse({"id": sid, "upload_url": url, "length": length,
+                         "expires_in": UPLOAD_SESSION_TTL_SECONDS},
+                        status_code=201, headers={"Location": url})
 
-    mime, _magic_ext = _guess(tmp)
-    if not mime:
-        tmp.unlink(missing_ok=True)
-        raise HTTPException(415, "unsupported media type")
+@app.put("/uploads/{sid}", status_code=204)
+async def put_upload_chunk(request: Request, sid: str):
+    session = await _io(_session, sid)
+    start, stop = _parse_content_range(request.headers.get("content-range"), session["length"])
+    # Vor dem ersten pwrite prüfen, sonst überschreibt ein kaputter Chunk bereits empfangene Daten
+    cl = request.headers.get("content-length")
+    if cl is not None and cl != str(stop - start):
+        raise HTTPException(400, "Content-Length does not match Content-Range")
+    fd = await _io(os.open, _session_path(sid), os.O_WRONLY)
+    pos = start
+    # Der Chunk ab Byte 0 wird sofort auf Magic-Bytes geprüft, nicht erst beim Finalisieren
+    head = bytearray() if start == 0 else None
+    try:
+        async for chunk in request.stream():
+            if pos + len(chunk) > stop:
+                raise HTTPException(400, "body longer than Content-Range")
+            if head is not None:
+                head += chunk[:SNIFF_BYTES - len(head)]
+                if len(head) >= min(SNIFF_BYTES, session["length"]):
+                    try:
+                        _sniff(bytes(head))
+                    except HTTPException:
+                        await _io(_abort_session, sid)
+                        raise
+                    head = None
+            await _io(os.pwrite, fd, chunk, pos)
+            pos += len(chunk)
+        if pos == stop:
+            # Erst als empfangen verbuchen, wenn die Bytes (je nach STORAGE_SYNC) auf der Platte sind
+            await _io(_sync_data, fd)
+    finally:
+        await _io(os.close, fd)
+    if pos != stop:
+        raise HTTPException(400, "body shorter than Content-Range")
+    await _io(_record_chunk, sid, start, stop)
+    ranges = await _io(_session_ranges, sid)
+    return Response(status_code=204, headers={"Upload-Offset": str(_session_offset(ranges)),
+                                              "Upload-Length": str(session["length"])})
 
-    orig_name = Path(file.filename).name
-    if mime in IMAGE_MIME:
-        fid = uuid.uuid4().hex
-        dst = IMAGES_DIR / f"{fid}{EXT_BY_MIME[mime]}"
-        tmp.rename(dst)
-        base = str(request.base_url).rstrip("/")
-        return JSONResponse({
-            "type":"image","id":fid,
-            "page_url":f"{base}/i/{fid}",
-            "raw_url":f"{base}/raw/image/{fid}",
-        })
-    elif mime in ARCHIVE_MIME:
-        fid = uuid.uuid4().hex
-        dst = FILES_DIR / f"{fid}{EXT_BY_MIME[mime]}"
-        tmp.rename(dst)
-        meta = {"id":fid,"original_name":orig_name,"saved_name":dst.name,
-                "size":dst.stat().st_size,
-                "created":datetime.fromtimestamp(dst.stat().st_mtime,timezone.utc).isoformat()}
-        (FILES_DIR/f"{fid}.json").write_text(json.dumps(meta),encoding="utf-8")
+@app.api_route("/uploads/{sid}", methods=["GET", "HEAD"])
+async def upload_session_status(request: Request, sid: str):
+    session = await _io(_session, sid)
+    ranges = await _io(_session_ranges, sid)
+    headers = {"Upload-Offset": str(_session_offset(ranges)), "Upload-Length": str(session["length"]),
+               "Cache-Control": "no-store"}
+    if request.method == "HEAD":
+        return Response(status_code=200, headers=headers)
+    return JSONResponse({"id": sid, "length": session["length"], "offset": _session_offset(ranges),
+                         "ranges": [[a, b] for a, b in ranges]}, headers=headers)
+
+@app.delete("/uploads/{sid}", status_code=204)
+async def abort_upload_session(sid: str):
+    await _io(_session, sid)
+    await _io(_abort_session, sid)
+    return Response(status_code=204)
+
+@app.post("/uploads/{sid}/finalize")
+async def finalize_upload_session(request: Request, sid: str):
+    path = _session_path(sid)
+    # Sperre vor dem Claim: ohne Session-Zeile hielte _sweep_staging die Datei sonst für verwaist
+    try:
+        lock = await _io(_lock_file, path)
+    except OSError:
+        raise HTTPException(404, "upload session not found")
+    try:
+        session = await _io(_claim_session, sid)
+        try:
+            mime = _sniff(await _io(_read_head, path))
+            sha256 = await _io(_hash_file, path)
+        except BaseException:
+            await _io(path.unlink, missing_ok=True)
+            raise
         base = str(request.base_url).rstrip("/")
-        return JSONResponse({
-            "type":"file","id":fid,
-            "page_url":f"{base}/f/{fid}",
-            "raw_url":f"{base}/raw/file/{fid}",
-            "original_name":orig_name,
-        })
+        return JSONResponse(await _io(_store, path, mime, session["length"], sha256, session["filename"], base))
+    finally:
+        await _io(lock.close)
 
-    tmp.unlink(missing_ok=True)
-    raise HTTPException(415,f"media type not allowed: {mime}")
+# -----------------
+# Conditional GET: ETag/Last-Modified aus dem Katalog, 304 ohne die Datei anzufassen
+# -----------------
+# Ändert sich mit jedem Deploy, damit geänderte Seitenvorlagen nicht als 304 hängen bleiben
+_PAGE_REV = hashlib.blake2b(Path(__file__).read_bytes(), digest_size=4).hexdigest()
+
+def _content_sha256(entry: IndexEntry) -> str:
+    """SHA-256 des Inhalts; für Uploads von vor dem Hashing einmalig berechnen und im Katalog nachtragen."""
+    if entry.sha256 is None:
+        # Aktuellen Pfad holen; die Layout-Migration kann die Datei inzwischen verschoben haben
+        fresh, _ = _lookup_stat(entry.id, entry.kind)
+        if fresh is None:
+            raise HTTPException(404, "not found")
+        entry = fresh
+        sha256 = _hash_file(entry.path)
+        _db().execute("UPDATE objects SET sha256 = ? WHERE id = ? AND sha256 IS NULL", (sha256, entry.id))
+        entry.sha256 = sha256
+    return entry.sha256
+
+async def _validators(entry: IndexEntry) -> dict:
+    sha256 = entry.sha256 or await _io(_content_sha256, entry)
+    return {"ETag": f'"{sha256}"', "Last-Modified": formatdate(entry.created, usegmt=True)}
+
+def _page_etag(entry: IndexEntry, ttl: int) -> str:
+    # Seiten hängen nur an Metadaten und Resttagen, nicht am Dateiinhalt
+    key = f"{_PAGE_REV}|{entry.id}|{entry.kind}|{entry.original_name}|{entry.size}|{ttl}"
+    return f'W/"{hashlib.blake2b(key.encode(), digest_size=12).hexdigest()}"'
+
+def _not_modified(request: Request, etag: str, last_modified: float | None = None) -> bool:
+    """If-None-Match (schwacher Vergleich) bzw. If-Modified-Since auswerten; If-None-Match hat Vorrang."""
+    inm = request.headers.get("if-none-match")
+    if inm is not None:
+        tags = {t.strip().removeprefix("W/") for t in inm.split(",")}
+        return "*" in tags or etag.removeprefix("W/") in tags
+    ims = request.headers.get("if-modified-since")
+    if ims and last_modified is not None:
+        try:
+            since = parsedate_to_datetime(ims)
+        except (TypeError, ValueError, IndexError):
+            return False
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=timezone.utc)
+        return int(last_modified) <= since.timestamp()
+    return False
 
 # -----------------
 # Einzelansichten (/i und /f)
 # -----------------
 @app.get("/i/{fid}", response_class=HTMLResponse)
 async def image_page(request: Request, fid: str):
-    matches = list(IMAGES_DIR.glob(f"{fid}.*")) + list(IMAGES_DIR.glob(fid))
-    if not matches:
-        if (FILES_DIR / f"{fid}.json").exists():
-            return RedirectResponse(url=f"/f/{fid}", status_code=302)
+    entry = await _io(_lookup, fid)
+    if entry is None:
         raise HTTPException(404, "not found")
+    if entry.kind != "image":
+        return RedirectResponse(url=f"/f/{fid}", status_code=302)
     raw_path = request.app.url_path_for("raw_image", fid=fid)
     raw_abs  = str(request.base_url).rstrip("/") + raw_path #Gives full URL (placeholder)
-    created = datetime.fromtimestamp(matches[0].stat().st_mtime, timezone.utc)
+    created = datetime.fromtimestamp(entry.created, timezone.utc)
     ttl = max(0, TTL_DAYS - (_now() - created).days)
-    return f"""
+    headers = {"ETag": _page_etag(entry, ttl), "Cache-Control": "no-cache"}
+    if _not_modified(request, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    return HTMLResponse(headers=headers, content=f"""
 <html><head><meta name='viewport' content='width=device-width, initial-scale=1'>
 <title>Bild {fid}</title>
 <link rel="icon" type="image/png" href="/assets/logo.png" sizes="512x512">
@@ -503,27 +1934,25 @@ async def image_page(request: Request, fid: str):
       btn.textContent='Copied!';setTimeout(()=>{{btn.textContent='Copy';}},1200);}}
   }};
 }})();
-</script></body></html>"""
+</script></body></html>""")
 
 @app.get("/f/{fid}", response_class=HTMLResponse)
 async def file_page(request: Request, fid: str):
-    meta_path = FILES_DIR / f"{fid}.json"
-    if not meta_path.exists():
-        matches = list(IMAGES_DIR.glob(f"{fid}.*"))
-        if matches:
-            return RedirectResponse(url=f"/i/{fid}", status_code=302)
+    entry = await _io(_lookup, fid)
+    if entry is None:
         raise HTTPException(404, "not found")
-    meta = json.loads(meta_path.read_text(encoding='utf-8'))
+    if entry.kind != "file":
+        return RedirectResponse(url=f"/i/{fid}", status_code=302)
     raw_path = request.app.url_path_for("raw_file", fid=fid)
-    real = [p for p in FILES_DIR.iterdir() if p.is_file() and p.stem == fid and p.suffix.lower() != '.json']
-    if not real: raise HTTPException(404, "not found")
-    p = real[0]
-    created = datetime.fromtimestamp(p.stat().st_mtime, timezone.utc)
+    created = datetime.fromtimestamp(entry.created, timezone.utc)
     ttl = max(0, TTL_DAYS - (_now() - created).days)
     icon_url = "/assets/zip_icon.png"
-    name = html.escape(meta.get('original_name') or fid)
-    size_kb = max(1, (p.stat().st_size // 1024))
-    return f"""
+    name = html.escape(entry.original_name or fid)
+    size_kb = max(1, (entry.size // 1024))
+    headers = {"ETag": _page_etag(entry, ttl), "Cache-Control": "no-cache"}
+    if _not_modified(request, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    return HTMLResponse(headers=headers, content=f"""
 <html><head><meta name='viewport' content='width=device-width, initial-scale=1'>
 <title>Datei {fid}</title>
 <link rel="icon" type="image/png" href="/assets/logo.png" sizes="512x512">
@@ -552,76 +1981,450 @@ async def file_page(request: Request, fid: str):
     <img src='{icon_url}' alt='file icon'/>
     <p><a class='btn' href='{raw_path}' download>Download</a></p>
   </div>
-</body></html>"""
+</body></html>""")
+
+# -----------------
+# Speicher-Cache für kleine Bilder
+# -----------------
+class ImageCache:
+    """Byte-budgetiertes LRU für kleine Bilder. Gleichzeitige Misses derselben fid teilen sich einen Lesevorgang.
+
+    Inhalte unter einer fid ändern sich nie; gelöschte fids werden vor dem Cache schon von _lookup
+    abgewiesen, discard gibt nur den Speicher frei.
+    """
+
+    def __init__(self, budget: int, max_object: int):
+        self.budget = budget
+        self.max_object = max_object
+        self.items: collections.OrderedDict[str, bytes] = collections.OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()  # discard kommt aus dem Cleanup-Thread
+        self.loading: dict[str, asyncio.Task] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    def fits(self, size: int) -> bool:
+        return 0 < size <= min(self.max_object, self.budget)
+
+    async def get(self, fid: str, load) -> bytes | None:
+        with self.lock:
+            body = self.items.get(fid)
+            if body is not None:
+                self.items.move_to_end(fid)
+                self.hits += 1
+                return body
+        task = self.loading.get(fid)
+        if task is None:
+            self.misses += 1
+            task = self.loading[fid] = asyncio.ensure_future(self._load(fid, load))
+        else:
+            self.coalesced += 1
+        # shield: bricht der erste Client ab, bekommen die übrigen trotzdem ihr Ergebnis
+        return await asyncio.shield(task)
+
+    async def _load(self, fid: str, load) -> bytes | None:
+        try:
+            body = await _io(load, fid)
+        finally:
+            self.loading.pop(fid, None)
+        if body is not None:
+            self.put(fid, body)
+        return body
+
+    def put(self, fid: str, body: bytes):
+        if not self.fits(len(body)):
+            return
+        with self.lock:
+            old = self.items.pop(fid, None)
+            if old is not None:
+                self.size -= len(old)
+            self.items[fid] = body
+            self.size += len(body)
+            while self.size > self.budget:
+                _, evicted = self.items.popitem(last=False)
+                self.size -= len(evicted)
+                self.evictions += 1
+
+    def discard(self, fid: str):
+        with self.lock:
+            body = self.items.pop(fid, None)
+            if body is not None:
+                self.size -= len(body)
+
+    def sweep(self, now: float):
+        """Bilder verwerfen, deren Index-Eintrag abgelaufen ist oder fehlt."""
+        with self.lock:
+            stale = [fid for fid in self.items if (e := _index.get(fid)) is None or e.expiry < now]
+        for fid in stale:
+            self.discard(fid)
+
+    def stats(self) -> dict:
+        return {"entries": len(self.items), "bytes": self.size, "budget": self.budget, "hits": self.hits,
+                "misses": self.misses, "coalesced": self.coalesced, "evictions": self.evictions}
+
+_image_cache = ImageCache(IMAGE_CACHE_MB * 1024 * 1024, IMAGE_CACHE_MAX_OBJECT_KB * 1024)
+
+def _read_image(fid: str) -> bytes | None:
+    entry, _ = _lookup_stat(fid, "image")
+    if entry is None:
+        return None
+    try:
+        return entry.path.read_bytes()
+    except FileNotFoundError:
+        return None
+
+# -----------------
+# Cache offener Dateien für Downloads
+# -----------------
+class OpenFile:
+    __slots__ = ("path", "fd", "st", "refs", "evicted")
+
+    def __init__(self, path: Path, fd: int, st: os.stat_result):
+        self.path = path
+        self.fd = fd
+        self.st = st
+        self.refs = 1
+        self.evicted = False
+
+class FdCache:
+    """Begrenzte Menge offener fds samt stat-Ergebnis, pro fid.
+
+    Laufende Antworten halten eine Referenz; ein verdrängter fd wird erst geschlossen, wenn die letzte
+    Antwort fertig ist. Gelesen wird per pread, damit sich gleichzeitige Downloads einen fd teilen können.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.items: collections.OrderedDict[str, OpenFile] = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def acquire(self, fid: str, kind: str) -> OpenFile | None:
+        with self.lock:
+            of = self.items.get(fid)
+            if of is not None:
+                self.items.move_to_end(fid)
+                of.refs += 1
+                self.hits += 1
+                return of
+            self.misses += 1
+        entry, _ = _lookup_stat(fid, kind)
+        if entry is None:
+            return None
+        try:
+            fd = os.open(entry.path, os.O_RDONLY | os.O_CLOEXEC)
+        except FileNotFoundError:
+            return None
+        of = OpenFile(entry.path, fd, os.fstat(fd))
+        with self.lock:
+            current = self.items.get(fid)
+            if current is not None:
+                # Ein paralleler Miss war schneller
+                current.refs += 1
+                os.close(fd)
+                return current
+            self.items[fid] = of
+            while len(self.items) > self.capacity:
+                _, old = self.items.popitem(last=False)
+                self.evictions += 1
+                self._retire(old)
+        return of
+
+    def release(self, of: OpenFile):
+        with self.lock:
+            of.refs -= 1
+            if of.evicted and of.refs == 0:
+                os.close(of.fd)
+
+    def discard(self, fid: str):
+        with self.lock:
+            of = self.items.pop(fid, None)
+            if of is not None:
+                self._retire(of)
+
+    def sweep(self, now: float):
+        """fds schließen, deren Eintrag abgelaufen ist oder deren Datei nirgends mehr verlinkt ist."""
+        with self.lock:
+            for fid, of in list(self.items.items()):
+                entry = _index.get(fid)
+                if (entry is not None and entry.expiry < now) or os.fstat(of.fd).st_nlink == 0:
+                    del self.items[fid]
+                    self._retire(of)
+
+    def _retire(self, of: OpenFile):
+        of.evicted = True
+        if of.refs == 0:
+            os.close(of.fd)
+
+    def stats(self) -> dict:
+        return {"open": len(self.items), "capacity": self.capacity, "hits": self.hits, "misses": self.misses,
+                "evictions": self.evictions}
+
+def _fd_cache_capacity() -> int:
+    # Höchstens ein Viertel des fd-Limits, der Rest bleibt für Sockets, SQLite und Uploads
+    soft, _ = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft == resource.RLIM_INFINITY:
+        return OPEN_FILE_CACHE_SIZE
+    return max(0, min(OPEN_FILE_CACHE_SIZE, soft // 4))
+
+_fd_cache = FdCache(_fd_cache_capacity())
+
+MAX_RANGES = 100  # wie FileResponse
+
+def _parse_range(value: str, size: int) -> list[tuple[int, int]]:
+    """Range-Header als sortierte, zusammengeführte [start, stop)-Liste; ValueError bei Syntaxfehlern.
+
+    Eine leere Liste heißt: syntaktisch gültig, aber kein Bereich erfüllbar (416).
+    """
+    unit, _, spec = value.partition("=")
+    if unit.strip().lower() != "bytes":
+        raise ValueError(value)
+    ranges = []
+    for part in spec.split(","):
+        first, sep, last = part.strip().partition("-")
+        if not sep or not (first or last) or not all(x.isdigit() for x in (first, last) if x):
+            raise ValueError(value)
+        if not first:  # Suffix: die letzten n Bytes
+            start, stop = max(0, size - int(last)), size
+        else:
+            start, stop = int(first), min(int(last) + 1, size) if last else size
+            if last and start > int(last):
+                raise ValueError(value)
+        if start < stop:  # sonst jenseits des Dateiendes, also nicht erfüllbar
+            ranges.append((start, stop))
+    merged = []
+    for start, stop in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], stop))
+        else:
+            merged.append((start, stop))
+    return merged
+
+class CachedFileResponse(Response):
+    """Download direkt aus einem fd des FdCache (pread): kein Pfad-Lookup, kein stat, kein open pro Request.
+
+    Bewusst keine FileResponse: die öffnet die Datei über einen privaten Hook, und fiele der weg, öffnete sie
+    wieder den Pfad, den die Layout-Migration inzwischen entfernt haben kann. Range (auch mehrere Bereiche),
+    If-Range, 206 und 416 verhalten sich wie bei FileResponse; das Streamen samt Abbruch bei Disconnect
+    übernimmt StreamingResponse.
+    """
+    chunk_size = DOWNLOAD_CHUNK_KB * 1024
+
+    def __init__(self, of: OpenFile, media_type: str, headers: dict):
+        super().__init__(media_type=media_type, headers={**headers, "Accept-Ranges": "bytes",
+                                                          "Content-Length": str(of.st.st_size)})
+        self.open_file = of
+
+    async def _read(self, start: int, stop: int):
+        while start < stop:
+            chunk = await _io(os.pread, self.open_file.fd, min(self.chunk_size, stop - start), start)
+            if not chunk:
+                raise RuntimeError(f"{self.open_file.path} is shorter than expected")
+            start += len(chunk)
+            yield chunk
+
+    async def _multipart(self, ranges: list[tuple[int, int]], part_headers: list[bytes], boundary: str):
+        for (start, stop), head in zip(ranges, part_headers):
+            yield head
+            async for chunk in self._read(start, stop):
+                yield chunk
+            yield b"\r\n"
+        yield f"--{boundary}--".encode()
+
+    def _ranged(self, scope) -> Response:
+        size = self.open_file.st.st_size
+        headers = dict(self.headers)
+        request_headers = Headers(scope=scope)
+        value = request_headers.get("range")
+        if_range = request_headers.get("if-range")
+        # Zu viele Bereiche: Range ignorieren und alles senden, wie FileResponse
+        if value is None or value.count(",") >= MAX_RANGES or (if_range is not None and if_range not in (headers.get("etag"), headers.get("last-modified"))):
+            return StreamingResponse(self._read(0, size), headers=headers)
+        try:
+            ranges = _parse_range(value, size)
+        except ValueError:
+            return PlainTextResponse("Malformed range header.", status_code=400)
+        if not ranges:
+            return PlainTextResponse("", status_code=416, headers={"Content-Range": f"bytes */{size}"})
+        if len(ranges) == 1:
+            start, stop = ranges[0]
+            headers.update({"content-range": f"bytes {start}-{stop - 1}/{size}", "content-length": str(stop - start)})
+            return StreamingResponse(self._read(start, stop), status_code=206, headers=headers)
+        boundary = secrets.token_hex(13)
+        part_headers = [f"--{boundary}\r\nContent-Type: {headers['content-type']}\r\n"
+                        f"Content-Range: bytes {start}-{stop - 1}/{size}\r\n\r\n".encode() for start, stop in ranges]
+        length = sum(len(h) + stop - start + 2 for h, (start, stop) in zip(part_headers, ranges)) + len(boundary) + 4
+        headers.update({"content-type": f"multipart/byteranges; boundary={boundary}", "content-length": str(length)})
+        return StreamingResponse(self._multipart(ranges, part_headers, boundary), status_code=206, headers=headers)
+
+    async def __call__(self, scope, receive, send):
+        try:
+            resp = self._ranged(scope)
+            if scope["method"] == "HEAD" and isinstance(resp, StreamingResponse):
+                # Nur Header; Content-Length bleibt die der GET-Antwort
+                resp.body_iterator = _empty_body()
+            await resp(scope, receive, send)
+        finally:
+            _fd_cache.release(self.open_file)
+
+async def _empty_body():
+    return
+    yield
+
+class StreamedFileResponse(FileResponse):
+    chunk_size = DOWNLOAD_CHUNK_KB * 1024
+
+def _pathsend(request: Request) -> bool:
+    # Der Server liest die Datei dann selbst (sendfile, ohne Umweg über Python); Range-Antworten streamt FileResponse weiter selbst
+    return "http.response.pathsend" in request.scope.get("extensions", {}) and "range" not in request.headers
+
+async def _file_response(request: Request, fid: str, kind: str, media_type: str, headers: dict) -> Response:
+    # Bei pathsend öffnet der Server den Pfad selbst, ein gecachter fd brächte nichts; der Pfad muss dafür frisch sein
+    if _fd_cache.capacity and not _pathsend(request):
+        of = await _io(_fd_cache.acquire, fid, kind)
+        if of is None: raise HTTPException(404, "not found")
+        return CachedFileResponse(of, media_type=media_type, headers=headers)
+    entry, st = await _io(_lookup_stat, fid, kind)
+    if entry is None: raise HTTPException(404, "not found")
+    return StreamedFileResponse(entry.path, media_type=media_type, stat_result=st, headers=headers)
 
 # -----------------
 # Raw Data
 # -----------------
-@app.get("/raw/image/{fid}")
-async def raw_image(fid: str):
-    matches = list(IMAGES_DIR.glob(f"{fid}.*")) + list(IMAGES_DIR.glob(fid))
-    if not matches: raise HTTPException(404, "not found")
-    p = matches[0]
-    ext = p.suffix.lower().lstrip(".")
-    media = {"jpg":"image/jpeg","jpeg":"image/jpeg","png":"image/png","gif":"image/gif","webp":"image/webp"}.get(ext,"application/octet-stream")
-    resp = FileResponse(p, media_type=media)
-    resp.headers["Cache-Control"]="public, max-age=604800, immutable"
-    return resp
+def _offload_target(path: Path) -> str:
+    rel = path.relative_to(DATA_ROOT).as_posix()
+    if DOWNLOAD_OFFLOAD == "nginx":
+        return quote(f"{DOWNLOAD_OFFLOAD_PREFIX.rstrip('/')}/{rel}")
+    prefix = DOWNLOAD_OFFLOAD_PREFIX or str(DATA_ROOT.resolve())
+    return f"{prefix.rstrip('/')}/{rel}"
 
-@app.get("/raw/file/{fid}")
-async def raw_file(fid: str):
-    meta_path = FILES_DIR / f"{fid}.json"
-    if not meta_path.exists(): raise HTTPException(404,"not found")
-    meta = json.loads(meta_path.read_text(encoding='utf-8'))
-    file_matches=[p for p in FILES_DIR.iterdir() if p.is_file() and p.stem==fid and p.suffix.lower()!='.json']
-    if not file_matches: raise HTTPException(404,"not found")
-    p=file_matches[0]
-    mime_magic,_=_guess(p)
-    media_type,_=mimetypes.guess_type(p.name)
-    final_mime=mime_magic or media_type or 'application/octet-stream'
-    resp=FileResponse(p,media_type=final_mime)
-    disp=_safe_disp_name(meta.get('original_name') or p.name)
-    resp.headers["Content-Disposition"]=f"attachment; filename*={disp}"
-    resp.headers["Cache-Control"]="public, max-age=604800"
-    return resp
+async def _offload_response(fid: str, kind: str, media_type: str, headers: dict) -> Response:
+    """Nur Header; den Inhalt (samt Range) liefert der Proxy aus seiner internen Location."""
+    entry, _ = await _io(_lookup_stat, fid, kind)
+    if entry is None: raise HTTPException(404, "not found")
+    header = "X-Accel-Redirect" if DOWNLOAD_OFFLOAD == "nginx" else "X-Sendfile"
+    return Response(status_code=200, media_type=media_type, headers={**headers, header: _offload_target(entry.path)})
+
+def _head_response(request: Request, entry: IndexEntry, media_type: str, headers: dict) -> Response | None:
+    """HEAD ohne Range direkt aus dem Katalog beantworten; Range-HEADs laufen über die Datei-Antworten (206/416)."""
+    if request.method != "HEAD" or "range" in request.headers:
+        return None
+    return Response(status_code=200, media_type=media_type,
+                    headers={**headers, "Content-Length": str(entry.size), "Accept-Ranges": "bytes"})
+
+# GET und HEAD; Range (auch mehrere Bereiche), If-Range, 206 und 416 übernehmen FileResponse bzw. CachedFileResponse
+@app.api_route("/raw/image/{fid}", methods=["GET", "HEAD"])
+async def raw_image(request: Request, fid: str):
+    entry = await _io(_lookup, fid, "image")
+    if entry is None: raise HTTPException(404, "not found")
+    headers = {**await _validators(entry), "Cache-Control": "public, max-age=604800, immutable"}
+    if _not_modified(request, headers["ETag"], entry.created):
+        return Response(status_code=304, headers=headers)
+    if (resp := _head_response(request, entry, entry.mime, headers)) is not None:
+        return resp
+    if DOWNLOAD_OFFLOAD != "off":
+        return await _offload_response(fid, "image", entry.mime, headers)
+    if _image_cache.fits(entry.size) and "range" not in request.headers:
+        body = await _image_cache.get(fid, _read_image)
+        if body is None: raise HTTPException(404, "not found")
+        return Response(body, media_type=entry.mime, headers={**headers, "Accept-Ranges": "bytes"})
+    return await _file_response(request, fid, "image", entry.mime, headers)
+
+@app.api_route("/raw/file/{fid}", methods=["GET", "HEAD"])
+async def raw_file(request: Request, fid: str):
+    entry=await _io(_lookup,fid,"file")
+    if entry is None: raise HTTPException(404,"not found")
+    headers={**await _validators(entry),"Cache-Control":"public, max-age=604800",
+             "Content-Disposition":f"attachment; filename*={_safe_disp_name(entry.original_name or entry.path.name)}"}
+    if _not_modified(request,headers["ETag"],entry.created):
+        return Response(status_code=304,headers=headers)
+    # Typ, Größe und Pfad stehen seit dem Upload im Katalog; hier wird nichts mehr gelesen oder geraten
+    if (resp:=_head_response(request,entry,entry.mime,headers)) is not None:
+        return resp
+    if DOWNLOAD_OFFLOAD!="off":
+        return await _offload_response(fid,"file",entry.mime,headers)
+    return await _file_response(request,fid,"file",entry.mime,headers)
 
 # -----------------
 # Listen mit Pagination
 # -----------------
-def _paginate(items,page:int,limit:int):
-    total=len(items)
+def _count(kind:str) -> int:
+    return _db().execute("SELECT COUNT(*) FROM objects WHERE kind = ? AND expiry >= ?",(kind,_now().timestamp())).fetchone()[0]
+
+def _encode_cursor(row) -> str:
+    raw=f"{row['created']!r}:{row['id']}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def _decode_cursor(cursor:str):
+    try:
+        raw=base64.urlsafe_b64decode(cursor+"="*(-len(cursor)%4)).decode()
+        created,fid=raw.split(":",1)
+        return float(created),fid
+    except Exception:
+        raise HTTPException(400,"invalid cursor")
+
+def _paginate(kind:str,page:int,limit:int):
+    total=_count(kind)
     total_pages=max(1,math.ceil(total/limit)) if limit>0 else 1
     page=max(1,min(page,total_pages))
-    start=(page-1)*limit; end=start+limit
-    return items[start:end],dict(page=page,per_page=limit,total=total,total_pages=total_pages)
+    rows=_db().execute("SELECT * FROM objects WHERE kind = ? AND expiry >= ? ORDER BY created DESC, id DESC LIMIT ? OFFSET ?",
+                       (kind,_now().timestamp(),limit+1,(page-1)*limit)).fetchall()
+    next_cursor=_encode_cursor(rows[limit-1]) if len(rows)>limit else None
+    return rows[:limit],dict(page=page,per_page=limit,total=total,total_pages=total_pages,next_cursor=next_cursor)
+
+def _paginate_cursor(kind:str,cursor:str,limit:int,count:bool):
+    # Keyset-Pagination über (created, id): kostet O(limit) unabhängig von der Seitentiefe
+    if cursor:
+        created,fid=_decode_cursor(cursor)
+        rows=_db().execute("SELECT * FROM objects WHERE kind = ? AND (created, id) < (?, ?) AND expiry >= ?"
+                           " ORDER BY created DESC, id DESC LIMIT ?",
+                           (kind,created,fid,_now().timestamp(),limit+1)).fetchall()
+    else:
+        rows=_db().execute("SELECT * FROM objects WHERE kind = ? AND expiry >= ? ORDER BY created DESC, id DESC LIMIT ?",
+                           (kind,_now().timestamp(),limit+1)).fetchall()
+    next_cursor=_encode_cursor(rows[limit-1]) if len(rows)>limit else None
+    meta=dict(per_page=limit,next_cursor=next_cursor)
+    if count: meta['total']=_count(kind)
+    return rows[:limit],meta
+
+def _iso(ts:float) -> str: return datetime.fromtimestamp(ts,timezone.utc).isoformat()
 
 @app.get("/list/images")
-async def list_images(page:int=Query(1,ge=1),limit:int=Query(15,ge=1,le=100)):
-    items=[{'id':p.stem,'page_url':f'/i/{p.stem}','raw_url':f'/raw/image/{p.stem}',
-            'created':datetime.fromtimestamp(p.stat().st_mtime,timezone.utc).isoformat()}
-            for p in IMAGES_DIR.iterdir() if p.is_file()]
-    items.sort(key=lambda x:x['created'],reverse=True)
-    sliced,meta=_paginate(items,page,limit)
-    return {'items':sliced,**meta}
+async def list_images(page:int=Query(1,ge=1),limit:int=Query(15,ge=1,le=100),
+                      cursor:str|None=Query(None),count:bool=Query(False)):
+    if cursor is not None: rows,meta=await _io(_paginate_cursor,"image",cursor,limit,count)
+    else: rows,meta=await _io(_paginate,"image",page,limit)
+    items=[{'id':r['id'],'page_url':f"/i/{r['id']}",'raw_url':f"/raw/image/{r['id']}",'created':_iso(r['created'])}
+           for r in rows]
+    return {'items':items,**meta}
 
 @app.get("/list/files")
-async def list_files(page:int=Query(1,ge=1),limit:int=Query(15,ge=1,le=100)):
-    items=[]
-    for meta in FILES_DIR.glob('*.json'):
-        try:
-            m=json.loads(meta.read_text(encoding='utf-8'))
-            fid=m.get('id') or meta.stem
-            items.append({'id':fid,'page_url':f'/f/{fid}','raw_url':f'/raw/file/{fid}',
-                          'created':m.get('created'),'size':m.get('size'),
-                          'original_name':m.get('original_name') or fid})
-        except Exception: continue
-    items.sort(key=lambda x:x.get('created') or '',reverse=True)
-    sliced,meta=_paginate(items,page,limit)
-    return {'items':sliced,**meta}
+async def list_files(page:int=Query(1,ge=1),limit:int=Query(15,ge=1,le=100),
+                     cursor:str|None=Query(None),count:bool=Query(False)):
+    if cursor is not None: rows,meta=await _io(_paginate_cursor,"file",cursor,limit,count)
+    else: rows,meta=await _io(_paginate,"file",page,limit)
+    items=[{'id':r['id'],'page_url':f"/f/{r['id']}",'raw_url':f"/raw/file/{r['id']}",
+            'created':_iso(r['created']),'size':r['size'],'original_name':r['original_name'] or r['id']}
+           for r in rows]
+    return {'items':items,**meta}
 
 @app.get("/health")
 async def health(): return {"status":"ok"}
 
+@app.get("/stats")
+async def stats():
+    clients=await _io(len,_rate_buckets) if _rate_buckets.blocking else len(_rate_buckets)
+    return {"uploads":_upload_admission.stats(),
+            "rate_limit":{**_rate_limit_counters,"clients":clients,"backend":RATE_LIMIT_BACKEND},
+            "storage_sync":{"mode":STORAGE_SYNC,"dir_fsync":_dir_sync.stats()},
+            "staging":await _io(_staging_usage),
+            "image_cache":_image_cache.stats(),
+            "open_files":_fd_cache.stats()}
+
 if __name__=="__main__":
     import uvicorn
     uvicorn.run(app,host="0.0.0.0",port=int(os.environ.get("PORT","8080")))
@@ -0,0 +1,101 @@
+"""Download-Durchsatz je CPU-Sekunde des Servers für große Archive über /raw/file.
+
+Vergleicht uvicorn (kein http.response.pathsend: Python streamt die Datei in DOWNLOAD_CHUNK_KB-Blöcken)
+mit Granian, sofern installiert (pathsend: der Server schickt die Datei selbst per sendfile).
+CPU-Zeit wird über /proc für den Serverprozess samt Kindprozessen gemessen. Nur Standardbibliothek.
+
+    python bench/bench_download.py --size-mb 14 --seconds 10 --clients 4
+"""
+import argparse
+import http.client
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from bench_upload import free_port, payload, start_server, uvicorn_cmd
+
+
+def granian_cmd(port: int) -> list[str]:
+    return [sys.executable, "-m", "granian", "--interface", "asgi", "--host", "127.0.0.1", "--port", str(port),
+            "--workers", "1", "--log-level", "warning", "main:app"]
+
+
+def cpu_seconds(pid: int) -> float:
+    """utime + stime von pid und allen Nachfahren."""
+    tick = os.sysconf("SC_CLK_TCK")
+    stats = {}
+    for p in Path("/proc").iterdir():
+        if p.name.isdigit():
+            try:
+                fields = (p / "stat").read_text().rsplit(")", 1)[1].split()
+            except OSError:
+                continue
+            stats[int(p.name)] = (int(fields[1]), int(fields[11]) + int(fields[12]))
+    total, todo = 0, [pid]
+    while todo:
+        cur = todo.pop()
+        total += stats.get(cur, (0, 0))[1]
+        todo += [child for child, (ppid, _) in stats.items() if ppid == cur]
+    return total / tick
+
+
+def run(name: str, cmd, size: int, seconds: float, clients: int, extra_env: dict | None = None) -> dict:
+    port = free_port()
+    with tempfile.TemporaryDirectory() as data_root:
+        proc = start_server(port, data_root, max_mb=size // (1024 * 1024) + 2, cmd=cmd(port),
+                            extra_env={"RATE_LIMIT_UPLOAD": "", "IMAGE_CACHE_MB": "0", **(extra_env or {})})
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+            conn.request("PUT", "/upload/bench.zip", body=payload(size))
+            resp = conn.getresponse()
+            fid = json.loads(resp.read())["id"]
+            received = [0] * clients
+            stop = time.perf_counter() + seconds
+
+            def worker(i: int):
+                c = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+                while time.perf_counter() < stop:
+                    c.request("GET", f"/raw/file/{fid}")
+                    r = c.getresponse()
+                    while chunk := r.read(1024 * 1024):
+                        received[i] += len(chunk)
+
+            cpu0, t0 = cpu_seconds(proc.pid), time.perf_counter()
+            threads = [threading.Thread(target=worker, args=(i,)) for i in range(clients)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            elapsed, cpu = time.perf_counter() - t0, cpu_seconds(proc.pid) - cpu0
+            total = sum(received)
+            return {"name": name, "MB/s": total / elapsed / 1e6, "MB/cpu-s": total / max(cpu, 1e-9) / 1e6, "cpu": cpu}
+        finally:
+            proc.terminate()
+            proc.wait()
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--size-mb", type=int, default=14)
+    ap.add_argument("--seconds", type=float, default=10)
+    ap.add_argument("--clients", type=int, default=4)
+    args = ap.parse_args()
+    runs = [("uvicorn chunk 64K", uvicorn_cmd, {"DOWNLOAD_CHUNK_KB": "64"}),
+            ("uvicorn chunk 256K", uvicorn_cmd, {"DOWNLOAD_CHUNK_KB": "256"}),
+            ("uvicorn chunk 1M", uvicorn_cmd, {"DOWNLOAD_CHUNK_KB": "1024"})]
+    try:
+        import granian  # noqa: F401
+        runs.append(("granian pathsend", granian_cmd, {}))
+    except ImportError:
+        print("granian nicht installiert, pathsend wird übersprungen")
+    for name, cmd, env in runs:
+        r = run(name, cmd, args.size_mb * 1024 * 1024, args.seconds, args.clients, env)
+        print(f"{r['name']:>18}: {r['MB/s']:8.1f} MB/s   {r['MB/cpu-s']:8.1f} MB je Server-CPU-Sekunde")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""p50/p99-Latenz von /raw/image, während parallel Uploads und Listen-Abfragen laufen.
+
+Misst, wie stark blockierende Arbeit in anderen Handlern den Event-Loop verzögert. Mit
+--app-dir lässt sich ein anderer Stand vergleichen, z. B. ein `git worktree` eines älteren Commits.
+
+    python bench/bench_latency.py --seconds 10 --uploaders 4 --listers 2
+"""
+import argparse
+import http.client
+import statistics
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from bench_upload import APP_DIR, free_port, payload, start_server
+
+PNG_1PX = bytes.fromhex(
+    "89504e470d0a1a0a0000000d4948445200000001000000010802000000907753de"
+    "0000000c4944415478da63f8ffff3f0005fe02fea7d6a4fb0000000049454e44ae426082")
+
+
+def put(conn: http.client.HTTPConnection, path: str, body: bytes) -> dict:
+    import json
+    conn.request("PUT", path, body=body, headers={"Content-Type": "application/octet-stream"})
+    resp = conn.getresponse()
+    data = resp.read()
+    if resp.status != 200:
+        raise RuntimeError(f"PUT {path}: HTTP {resp.status} {data[:200]!r}")
+    return json.loads(data)
+
+
+def load(port: int, stop: threading.Event, fn):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+    while not stop.is_set():
+        try:
+            fn(conn)
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--seconds", type=float, default=10)
+    ap.add_argument("--uploaders", type=int, default=4)
+    ap.add_argument("--listers", type=int, default=2)
+    ap.add_argument("--upload-mb", type=int, default=10)
+    ap.add_argument("--app-dir", type=Path, default=APP_DIR)
+    args = ap.parse_args()
+
+    port = free_port()
+    with tempfile.TemporaryDirectory() as data_root:
+        proc = start_server(port, data_root, max_mb=args.upload_mb + 1, app_dir=args.app_dir)
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+            fid = put(conn, "/upload/probe.png", PNG_1PX)["id"]
+            body = payload(args.upload_mb * 1024 * 1024)
+
+            def upload(c):
+                put(c, "/upload/load.zip", body)
+
+            def listing(c):
+                c.request("GET", "/list/files?page=1&limit=100")
+                c.getresponse().read()
+
+            stop = threading.Event()
+            workers = [threading.Thread(target=load, args=(port, stop, upload)) for _ in range(args.uploaders)]
+            workers += [threading.Thread(target=load, args=(port, stop, listing)) for _ in range(args.listers)]
+            for w in workers:
+                w.start()
+
+            latencies = []
+            deadline = time.time() + args.seconds
+            while time.time() < deadline:
+                t0 = time.perf_counter()
+                conn.request("GET", f"/raw/image/{fid}")
+                resp = conn.getresponse()
+                resp.read()
+                latencies.append((time.perf_counter() - t0) * 1000)
+                if resp.status != 200:
+                    raise RuntimeError(f"/raw/image: HTTP {resp.status}")
+            stop.set()
+            for w in workers:
+                w.join()
+        finally:
+            proc.terminate()
+            proc.wait()
+
+    latencies.sort()
+    p = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))]
+    print(f"/raw/image: n={len(latencies)}  p50 {p(0.50):.2f} ms  p99 {p(0.99):.2f} ms  "
+          f"max {latencies[-1]:.2f} ms  mean {statistics.fmean(latencies):.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""Overhead der Middleware-Schicht für Host-Prüfung + Security-Header pro Request, direkt per ASGI im Prozess.
+
+Vergleicht die frühere Kombination (SecurityHeaders als BaseHTTPMiddleware + TrustedHostMiddleware) mit der
+reinen ASGI-Schicht aus main.py, jeweils vor einer kleinen JSON-Antwort und einem gestreamten 4-MB-Body,
+und misst zusätzlich den kompletten Middleware-Stack der App auf /health. Nur Standardbibliothek + App-Abhängigkeiten.
+
+    python bench/bench_middleware.py --requests 20000
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app")
+os.environ.setdefault("DATA_ROOT", tempfile.mkdtemp())
+os.environ.setdefault("ALLOWED_HOSTS", "bench")
+os.environ.setdefault("RATE_LIMIT_LIST", "")
+sys.path.insert(0, APP_DIR)
+
+from starlette.applications import Starlette  # noqa: E402
+from starlette.middleware import Middleware  # noqa: E402
+from starlette.middleware.base import BaseHTTPMiddleware  # noqa: E402
+from starlette.middleware.trustedhost import TrustedHostMiddleware  # noqa: E402
+from starlette.responses import JSONResponse, StreamingResponse  # noqa: E402
+from starlette.routing import Route  # noqa: E402
+
+import main  # noqa: E402
+
+CHUNK = b"x" * 65536
+
+
+class LegacySecurityHeaders(BaseHTTPMiddleware):
+    """Die frühere Variante, zum Vergleich."""
+
+    async def dispatch(self, request, call_next):
+        resp = await call_next(request)
+        for name, value in main.SecurityHeadersMiddleware.COMMON:
+            resp.headers.setdefault(name.decode(), value.decode())
+        if request.url.scheme == "https":
+            resp.headers.setdefault("strict-transport-security", main.SecurityHeadersMiddleware.HSTS[1].decode())
+        if resp.headers.get("content-type", "").startswith("text/html"):
+            for name, value in main.SecurityHeadersMiddleware.HTML:
+                resp.headers.setdefault(name.decode(), value.decode())
+        return resp
+
+
+async def small(request):
+    return JSONResponse({"status": "ok"})
+
+
+async def stream(request):
+    async def body():
+        for _ in range(64):
+            yield CHUNK
+    return StreamingResponse(body(), media_type="application/octet-stream")
+
+
+def build(middleware: list[Middleware]) -> Starlette:
+    return Starlette(routes=[Route("/small", small), Route("/stream", stream)], middleware=middleware)
+
+
+def scope(path: str) -> dict:
+    # spec_version 2.4: StreamingResponse wartet dann nicht parallel auf http.disconnect
+    return {"type": "http", "asgi": {"version": "3.0", "spec_version": "2.4"}, "http_version": "1.1", "method": "GET",
+            "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": b"", "root_path": "",
+            "headers": [(b"host", b"bench")], "client": ("127.0.0.1", 1234), "server": ("bench", 80)}
+
+
+async def measure(app, path: str, n: int) -> float:
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        pass
+
+    s = scope(path)
+    for _ in range(min(n, 200)):  # aufwärmen
+        await app(dict(s), receive, send)
+    t0 = time.perf_counter()
+    for _ in range(n):
+        await app(dict(s), receive, send)
+    return (time.perf_counter() - t0) / n * 1e6
+
+
+async def run(n: int):
+    stacks = {
+        "ohne Middleware": build([]),
+        "BaseHTTPMiddleware + TrustedHost": build([Middleware(LegacySecurityHeaders),
+                                                   Middleware(TrustedHostMiddleware, allowed_hosts=["bench"])]),
+        "reines ASGI (fusioniert)": build([Middleware(main.SecurityHeadersMiddleware, allowed_hosts=["bench"])]),
+    }
+    for path, count in (("/small", n), ("/stream", max(1, n // 20))):
+        base = None
+        for name, app in stacks.items():
+            us = await measure(app, path, count)
+            base = us if base is None else base
+            print(f"{path:>8} {name:>34}: {us:8.1f} µs/Request  (+{us - base:6.1f})")
+    async with main.lifespan(main.app):
+        print(f"{'/health':>8} {'kompletter Stack von main.app':>34}: {await measure(main.app, '/health', n):8.1f} µs/Request")
+
+
+def main_():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--requests", type=int, default=20000)
+    asyncio.run(run(ap.parse_args().requests))
+
+
+if __name__ == "__main__":
+    main_()
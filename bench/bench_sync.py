@@ -0,0 +1,70 @@
+"""Upload-Durchsatz je STORAGE_SYNC-Modus (none / data / full) bei parallelen rohen PUTs.
+
+Pro Modus ein eigener uvicorn-Prozess mit leerem DATA_ROOT. Zeigt zusätzlich, wie viele
+Verzeichnis-fsyncs der Group-Commit im Modus full zusammengefasst hat. Nur Standardbibliothek.
+
+    python bench/bench_sync.py --size-kb 256 --count 400 --clients 16
+"""
+import argparse
+import http.client
+import json
+import tempfile
+import threading
+import time
+
+from bench_upload import free_port, payload, start_server
+
+
+def run(mode: str, size: int, count: int, clients: int) -> dict:
+    port = free_port()
+    with tempfile.TemporaryDirectory() as data_root:
+        proc = start_server(port, data_root, max_mb=size // (1024 * 1024) + 2,
+                            extra_env={"STORAGE_SYNC": mode, "DEDUP_UPLOADS": "0", "RATE_LIMIT_UPLOAD": "",
+                                       "UPLOAD_MAX_CONCURRENT": str(clients), "UPLOAD_QUEUE_SIZE": str(clients)})
+        try:
+            per_client = count // clients
+            errors = []
+
+            def worker():
+                conn = http.client.HTTPConnection("127.0.0.1", port, timeout=120)
+                for _ in range(per_client):
+                    conn.request("PUT", "/upload/bench.zip", body=payload(size),
+                                 headers={"Content-Type": "application/octet-stream"})
+                    resp = conn.getresponse()
+                    resp.read()
+                    if resp.status != 200:
+                        errors.append(resp.status)
+
+            threads = [threading.Thread(target=worker) for _ in range(clients)]
+            t0 = time.perf_counter()
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            elapsed = time.perf_counter() - t0
+            if errors:
+                raise RuntimeError(f"{mode}: HTTP {sorted(set(errors))}")
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+            conn.request("GET", "/stats")
+            dir_fsync = json.loads(conn.getresponse().read())["storage_sync"]["dir_fsync"]
+            done = per_client * clients
+            return {"mode": mode, "uploads/s": done / elapsed, "MB/s": size * done / elapsed / 1e6, **dir_fsync}
+        finally:
+            proc.terminate()
+            proc.wait()
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--size-kb", type=int, default=256)
+    ap.add_argument("--count", type=int, default=400)
+    ap.add_argument("--clients", type=int, default=16)
+    args = ap.parse_args()
+    for mode in ("none", "data", "full"):
+        r = run(mode, args.size_kb * 1024, args.count, args.clients)
+        print(f"{r['mode']:>5}: {r['uploads/s']:8.1f} uploads/s {r['MB/s']:8.1f} MB/s   "
+              f"dir fsync: {r['dirs']} Verzeichnisse in {r['batches']} Durchgängen")
+
+
+if __name__ == "__main__":
+    main()
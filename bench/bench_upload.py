@@ -0,0 +1,116 @@
+"""Durchsatz und Spitzen-RSS: Multipart-POST /upload, rohes PUT /upload/{filename} und POST /upload/batch.
+
+Startet für jeden Modus einen eigenen uvicorn-Prozess mit leerem DATA_ROOT, damit VmHWM
+(höchster RSS des Serverprozesses) nur diesen Modus misst. Nur Standardbibliothek.
+
+    python bench/bench_upload.py --size-mb 14 --count 20 --batch 5
+"""
+import argparse
+import http.client
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from pathlib import Path
+
+APP_DIR = Path(__file__).resolve().parent.parent / "app"
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def uvicorn_cmd(port: int) -> list[str]:
+    return [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"]
+
+
+def start_server(port: int, data_root: str, max_mb: int, extra_env: dict | None = None,
+                 app_dir: Path = APP_DIR, cmd: list[str] | None = None) -> subprocess.Popen:
+    env = dict(os.environ, DATA_ROOT=data_root, MAX_FILE_MB=str(max_mb), ALLOWED_HOSTS="127.0.0.1,localhost",
+               TTL_DAYS="1", **(extra_env or {}))
+    proc = subprocess.Popen(cmd or uvicorn_cmd(port), cwd=app_dir, env=env)
+    deadline = time.time() + 20
+    while time.time() < deadline:
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            conn.request("GET", "/health")
+            if conn.getresponse().status == 200:
+                return proc
+        except OSError:
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError("server did not start")
+
+
+def peak_rss_mb(pid: int) -> float:
+    for line in Path(f"/proc/{pid}/status").read_text().splitlines():
+        if line.startswith("VmHWM:"):
+            return int(line.split()[1]) / 1024
+    return float("nan")
+
+
+def payload(size: int) -> bytes:
+    # ZIP-Magic vorn, Rest zufällig: wird als Archiv klassifiziert
+    return b"PK\x03\x04" + os.urandom(size - 4)
+
+
+def multipart(body: bytes, parts: int = 1, field: str = "file") -> tuple[bytes, str]:
+    boundary = uuid.uuid4().hex
+    head = (f"--{boundary}\r\nContent-Disposition: form-data; name=\"{field}\"; filename=\"bench.zip\"\r\n"
+            f"Content-Type: application/octet-stream\r\n\r\n").encode()
+    part = head + body + b"\r\n"
+    return part * parts + f"--{boundary}--\r\n".encode(), f"multipart/form-data; boundary={boundary}"
+
+
+def run(mode: str, size: int, count: int, extra_env: dict | None = None, batch: int = 5) -> dict:
+    """count Dateien hochladen; im Modus batch jeweils batch Dateien pro Request."""
+    port = free_port()
+    with tempfile.TemporaryDirectory() as data_root:
+        proc = start_server(port, data_root, max_mb=size // (1024 * 1024) + 2,
+                            extra_env={"RATE_LIMIT_UPLOAD": "", **(extra_env or {})})
+        try:
+            body = payload(size)
+            requests = count
+            if mode == "multipart":
+                body, ctype = multipart(body)
+                method, path = "POST", "/upload"
+            elif mode == "batch":
+                requests = count // batch
+                count = requests * batch
+                body, ctype = multipart(body, batch, "files")
+                method, path = "POST", "/upload/batch"
+            else:
+                ctype, method, path = "application/octet-stream", "PUT", "/upload/bench.zip"
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=120)
+            t0 = time.perf_counter()
+            for _ in range(requests):
+                conn.request(method, path, body=body, headers={"Content-Type": ctype})
+                resp = conn.getresponse()
+                resp.read()
+                if resp.status != 200:
+                    raise RuntimeError(f"{mode}: HTTP {resp.status}")
+            elapsed = time.perf_counter() - t0
+            return {"mode": mode, "MB/s": size * count / elapsed / 1e6, "peak_rss_mb": peak_rss_mb(proc.pid)}
+        finally:
+            proc.terminate()
+            proc.wait()
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--size-mb", type=int, default=14)
+    ap.add_argument("--count", type=int, default=20)
+    ap.add_argument("--batch", type=int, default=5, help="Dateien pro Request im Modus batch")
+    args = ap.parse_args()
+    for mode in ("multipart", "batch", "raw"):
+        r = run(mode, args.size_mb * 1024 * 1024, args.count, batch=args.batch)
+        print(f"{r['mode']:>10}: {r['MB/s']:8.1f} MB/s   peak RSS {r['peak_rss_mb']:7.1f} MB")
+
+
+if __name__ == "__main__":
+    main()